@@ -545,6 +545,10 @@ void VBS::ProcessEvent(AnalysisEvent *event)
   }
 	*/
   ntupVar("mc_weight", event->getMCWeights()[0]);
+  // all generator weights, for the weight-variation histograms of rehist.py --variations mc_weights
+  // (the vector overloads of ntupVar take a non-const reference, so no temporaries)
+  std::vector<float> mc_weights = event->getMCWeights();
+  ntupVar("mc_weights", mc_weights);
 
   ntupVar("gen_filt_met", gen_filt_met);
   ntupVar("gen_filt_ht", gen_filt_ht);
@@ -628,6 +632,14 @@ void VBS::ProcessEvent(AnalysisEvent *event)
   ntupVar("truth_id1", jetFlavor(signalJets[1]));
   ntupVar("truth_id2", jetFlavor(signalJets[2]));
   ntupVar("truth_id3", jetFlavor(signalJets[3]));
+  // object kinematics (sigjets_pt, sigjets_eta, ...) so kinematics.py can recompute and check the variables above
+  ntupVar("sigjets", signalJets, true);
+  std::vector<int> sigjets_btag;
+  for (const auto& jet : signalJets) sigjets_btag.push_back(jet.pass(BTag77MV2c10));
+  ntupVar("sigjets_btag", sigjets_btag);
+  ntupVar("sigelectrons", signalElectrons, true);
+  ntupVar("sigmuons", signalMuons, true);
+  ntupVar("sigtaus", signalTaus, true);
 
   //#ifdef PACKAGE_BTaggingTruthTagging
   //  ntupVar("weight_2b_in", m_TTres.map_trf_weight_in["Nominal"].at(2));
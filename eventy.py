@@ -1,22 +1,100 @@
+import argparse
+import sys
+import numpy as np
+
 L2=140
 L3=300
 LHL=3000
 brHWWbb=.21*.58
+# cross sections in fb, luminosities in fb^-1, so xsec*L is a number of events
 xsec = .266
-ib=input("Is this L2, L3, or LHL? ")
-while ib != "no":
-
-	ia=input("Branching ratio: ")
-	ia=float(ia)
-
-
-	if ib == "L2":
-		eventy = xsec*L2*ia*brHWWbb
-		print(eventy)
-	if ib == "L3":
-		eventy = xsec*L3*ia*brHWWbb
-		print(eventy)
-	if ib == "LHL":
-		eventy = xsec*LHL*ia*brHWWbb
-		print(eventy)
-	ib=input("Is this L2, L3, or LHL, type no to stop? ")
+
+lumis = {"L2": L2, "L3": L3, "LHL": LHL}
+
+
+def lumi_value(l):
+    # "L2"/"L3"/"LHL" or a number in fb^-1
+    if l in lumis:
+        return lumis[l]
+    return float(l)
+
+
+def yields(br, lumi=(L2, L3, LHL), xs=xsec, brhwwbb=brHWWbb):
+    # xsec*L*BR*brHWWbb for every combination in one broadcast
+    # returns shape (len(xs), len(lumi), len(br)), scalars count as length 1
+    br = np.atleast_1d(np.asarray(br, dtype=np.float64))
+    lumi = np.atleast_1d(np.asarray([lumi_value(l) for l in np.atleast_1d(lumi)], dtype=np.float64))
+    xs = np.atleast_1d(np.asarray(xs, dtype=np.float64))
+    return xs[:, None, None] * lumi[None, :, None] * br[None, None, :] * brhwwbb
+
+
+def table(br, lumi=(L2, L3, LHL), xs=xsec, brhwwbb=brHWWbb):
+    # long table, one row per (xsec, lumi, br): columns xsec, lumi, br, yield
+    br = np.atleast_1d(np.asarray(br, dtype=np.float64))
+    lumi = np.atleast_1d(np.asarray([lumi_value(l) for l in np.atleast_1d(lumi)], dtype=np.float64))
+    xs = np.atleast_1d(np.asarray(xs, dtype=np.float64))
+    y = yields(br, lumi, xs, brhwwbb)
+    grid = np.meshgrid(xs, lumi, br, indexing="ij")
+    return np.column_stack([g.ravel() for g in grid] + [y.ravel()])
+
+
+def read_values(path):
+    # one number per line (or whitespace/comma separated), "#" comments allowed
+    with open(path) as fin:
+        text = fin.read()
+    vals = []
+    for line in text.splitlines():
+        line = line.split("#")[0]
+        vals += [float(v) for v in line.replace(",", " ").split()]
+    return np.array(vals)
+
+
+def interactive():
+    ib=input("Is this L2, L3, or LHL? ")
+    while ib != "no":
+
+        ia=input("Branching ratio: ")
+        ia=float(ia)
+
+        if ib in lumis:
+            print(float(yields(ia, ib)[0, 0, 0]))
+        ib=input("Is this L2, L3, or LHL, type no to stop? ")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="signal yields xsec*L*BR*brHWWbb over whole grids")
+    parser.add_argument("--br", nargs="+", type=float, default=[], help="branching ratios")
+    parser.add_argument("--br-file", help="file with branching ratios")
+    parser.add_argument("--br-range", nargs=3, type=float, metavar=("START", "STOP", "N"), help="N evenly spaced branching ratios")
+    parser.add_argument("--lumi", nargs="+", default=["L2", "L3", "LHL"], help="L2, L3, LHL or numbers in fb^-1")
+    parser.add_argument("--xsec", nargs="+", type=float, default=[xsec], help="cross sections (fb)")
+    parser.add_argument("--xsec-file", help="file with cross sections")
+    parser.add_argument("-o", "--output", help="output table (.csv or .npy), stdout if not given")
+    args = parser.parse_args(argv)
+
+    br = list(args.br)
+    if args.br_file:
+        br += list(read_values(args.br_file))
+    if args.br_range:
+        br += list(np.linspace(args.br_range[0], args.br_range[1], int(args.br_range[2])))
+    xs = list(args.xsec)
+    if args.xsec_file:
+        xs = list(read_values(args.xsec_file))
+    if not br:
+        parser.error("no branching ratios given (--br, --br-file or --br-range)")
+
+    tab = table(br, args.lumi, xs)
+    header = "xsec,lumi,br,yield"
+    if args.output and args.output.endswith(".npy"):
+        np.save(args.output, tab)
+    elif args.output:
+        np.savetxt(args.output, tab, delimiter=",", header=header, comments="", fmt="%.10g")
+    else:
+        np.savetxt(sys.stdout, tab, delimiter=",", header=header, comments="", fmt="%.10g")
+
+
+if __name__=="__main__":
+    if len(sys.argv) > 1:
+        main()
+    else:
+        interactive()
@@ -0,0 +1,115 @@
+import numpy as np
+
+# pairwise features (dR, dphi, invariant mass) for the leading N objects of jagged
+# per-event collections, replacing the hand written dR_j1_j2 ... blocks in VBS.cxx
+# a collection is flat per-object arrays (pt, eta, phi, optionally m) plus offsets with
+# nevents+1 entries, like ROOT/awkward jagged storage
+# pairs that don't exist in an event get -999, the same sentinel VBS.cxx uses
+
+missing = -999.
+
+# short name used in the variable names, title word used in the axis titles, N objects
+collections = {
+    "jets": ("j", "jets", 6),
+    "bjets": ("bj", "bjets", 4),
+    "leptons": ("l", "lep", 2),
+}
+
+# binning of each feature kind: dR as the dR_* histograms of VBS::Init, the dphi and m
+# binnings are chosen here (VBS::Init books no pair histograms of those), dphi like dphi_min
+kind_specs = {
+    "dR": ((80, 0, 12), "dR of {} {} and {}"),
+    "dphi": ((40, 0, 4), "dphi of {} {} and {}"),
+    "m": ((200, 0, 1000), "Invariant M of {} {} and {}, (GeV)"),
+}
+
+
+def pad(values, offsets, n, fill=np.nan):
+    # first n objects of every event as a dense (n, nevents) array, object-major so
+    # every row is contiguous
+    values = np.asarray(values, dtype=np.float64)
+    offsets = np.asarray(offsets, dtype=np.int64)
+    counts = np.diff(offsets)
+    slot = np.arange(n)
+    valid = slot[:, None] < counts[None, :]
+    if len(values) == 0:
+        return np.full(valid.shape, fill)
+    idx = np.minimum(offsets[None, :-1] + slot[:, None], len(values) - 1)
+    return np.where(valid, values[idx], fill)
+
+
+def pairs(n):
+    return list(zip(*np.triu_indices(n, 1)))
+
+
+def names(short, n, kind="dR"):
+    # dR_j1_j2, dR_j1_j3, ... in the same order as VBS.cxx
+    return ["{}_{}{}_{}{}".format(kind, short, i+1, short, j+1) for i, j in pairs(n)]
+
+
+def pair_features(pt, eta, phi, offsets, n, m=None, short="j", kinds=("dR", "dphi", "m")):
+    # all pairs of the leading n objects, each pair vectorized over every event
+    # returns name -> (nevents,) array
+    pt = pad(pt, offsets, n)
+    eta = pad(eta, offsets, n)
+    phi = pad(phi, offsets, n)
+    have = ~np.isnan(pt)
+    if "m" in kinds:
+        m = np.zeros_like(pt) if m is None else np.nan_to_num(pad(m, offsets, n))
+        px, py = pt*np.cos(phi), pt*np.sin(phi)
+        pz = pt*np.sinh(eta)
+        e = np.sqrt(px*px + py*py + pz*pz + m*m)
+    out = {}
+    for i, j in pairs(n):
+        ok = have[i] & have[j]
+        res = {}
+        if "dR" in kinds or "dphi" in kinds:
+            # phi is in [-pi, pi] so one wrap is enough
+            dphi = np.abs(phi[i] - phi[j])
+            dphi = np.where(dphi > np.pi, 2*np.pi - dphi, dphi)
+            res["dphi"] = dphi
+        if "dR" in kinds:
+            deta = eta[i] - eta[j]
+            res["dR"] = np.sqrt(deta*deta + dphi*dphi)
+        if "m" in kinds:
+            m2 = (e[i] + e[j])**2 - (px[i] + px[j])**2 - (py[i] + py[j])**2 - (pz[i] + pz[j])**2
+            res["m"] = np.sqrt(np.clip(m2, 0, None))
+        for kind in kinds:
+            out["{}_{}{}_{}{}".format(kind, short, i+1, short, j+1)] = np.where(ok, res[kind], missing)
+    return out
+
+
+def all_features(objects, sizes=None, kinds=("dR", "dphi", "m")):
+    # objects: collection -> dict with pt, eta, phi, offsets (and m), e.g. {"jets": {...}}
+    # sizes overrides the number of objects per collection, e.g. {"jets": 10}
+    out = {}
+    for coll, obj in objects.items():
+        short, word, n = collections[coll]
+        n = (sizes or {}).get(coll, n)
+        out.update(pair_features(obj["pt"], obj["eta"], obj["phi"], obj["offsets"], n, obj.get("m"), short, kinds))
+    return out
+
+
+def registry(sizes=None, kinds=("dR",)):
+    # name -> (binning, axis title) for every generated feature, for rehist.binning and uhist.xname
+    out = {}
+    for coll, (short, word, n) in collections.items():
+        n = (sizes or {}).get(coll, n)
+        for kind in kinds:
+            spec, title = kind_specs[kind]
+            for (i, j), name in zip(pairs(n), names(short, n, kind)):
+                out[name] = (spec, title.format(word, i+1, j+1))
+    return out
+
+
+def xnames(sizes=None, kinds=("dR",)):
+    return {k: v[1] for k, v in registry(sizes, kinds).items()}
+
+
+def binnings(sizes=None, kinds=("dR",)):
+    return {k: v[0] for k, v in registry(sizes, kinds).items()}
+
+
+def addhistogram_lines(sizes=None, kinds=("dR",)):
+    # the matching VBS::Init lines, if the C++ side ever needs them again
+    return ['addHistogram("{}",{},{},{});'.format(k, *v) for k, v in binnings(sizes, kinds).items()]
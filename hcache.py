@@ -0,0 +1,80 @@
+import hashlib
+import json
+import os
+import numpy as np
+
+# sidecar index for uhist.py --incremental
+# maps key name -> {"hash": fingerprint of the input histogram, "info": its histoinfo.txt line}
+# bump this if what goes into the fingerprint changes, old indexes are then ignored
+version = 3
+
+# TH1D/F/I/S/C bin content array types, by the last letter of the class name
+buffer_types = {"D": np.float64, "F": np.float32, "I": np.int32, "S": np.int16, "C": np.int8}
+
+
+def index_path(output):
+    return output + ".index.json"
+
+
+def fingerprint(h1, name, extra=""):
+    # bin contents + errors (flow bins included), the axis settings and the
+    # axis titles in use, so changing an xname entry also counts as a change
+    # extra: anything else the output depends on (e.g. the output layout)
+    # the arrays are hashed straight from the TH1 buffers, no per-bin python calls
+    sha = hashlib.sha1()
+    ax = h1.GetXaxis()
+    n = h1.GetNcells()
+    sha.update(repr((name, extra, h1.ClassName(), ax.GetTitle(), h1.GetYaxis().GetTitle(),
+                     ax.GetNbins(), ax.GetXmin(), ax.GetXmax())).encode())
+    bins = ax.GetXbins()
+    if bins.GetSize():
+        sha.update(np.frombuffer(bins.GetArray(), dtype=np.float64, count=bins.GetSize()).tobytes())
+    sha.update(np.frombuffer(h1.GetArray(), dtype=buffer_types[h1.ClassName()[-1]], count=n).tobytes())
+    sumw2 = h1.GetSumw2()
+    if sumw2.GetSize():
+        sha.update(np.frombuffer(sumw2.GetArray(), dtype=np.float64, count=sumw2.GetSize()).tobytes())
+    else:
+        # without Sumw2 the errors are sqrt(content), already covered by the contents
+        sha.update(b"no sumw2")
+    return sha.hexdigest()
+
+
+def fingerprint_hdata(h, extra=""):
+    # the same for a histio.hdata, without ROOT: arrays, binning and titles
+    sha = hashlib.sha1()
+    sha.update(repr((h.name, extra, h.title, h.xtitle, h.ytitle)).encode())
+    for a in (h.edges, h.values, h.sumw2):
+        sha.update(a.tobytes())
+    return sha.hexdigest()
+
+
+def read_versioned(path, version, field):
+    # data[field] of a JSON index written by write_versioned, {} if the file is missing,
+    # unreadable or of another version
+    if not os.path.exists(path):
+        return {}
+    with open(path) as fin:
+        try:
+            index = json.load(fin)
+        except ValueError:
+            return {}
+    if index.get("version") != version:
+        return {}
+    return index.get(field, {})
+
+
+def write_versioned(path, version, field, data):
+    # write to a temp file first so a crash mid-write can't leave a half index behind
+    with open(path + ".tmp", "w") as fout:
+        json.dump({"version": version, field: data}, fout, indent=1)
+    os.replace(path + ".tmp", path)
+
+
+def load_index(output):
+    if not os.path.exists(output):
+        return {}
+    return read_versioned(index_path(output), version, "keys")
+
+
+def save_index(output, keys):
+    write_versioned(index_path(output), version, "keys", keys)
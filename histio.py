@@ -0,0 +1,143 @@
+import numpy as np
+import uproot
+import keyfilter
+
+# ROOT-free access to the TH1 histograms in VBS.root / VBSnew.root, through uproot
+# everything here works on plain numpy arrays, `import ROOT` is never needed
+
+
+class hdata:
+    # one 1D histogram as numpy arrays
+    # edges has nbins+1 entries, values and sumw2 have nbins+2 (underflow and overflow included)
+    # sumw/sumwx are the stored fill statistics ROOT uses for GetMean, None if unknown
+
+    def __init__(self, name, edges, values, sumw2=None, title="", xtitle="", ytitle="", sumw=None, sumwx=None, entries=None):
+        self.name=name
+        self.edges=np.asarray(edges, dtype=np.float64)
+        self.values=np.asarray(values, dtype=np.float64)
+        if sumw2 is None:
+            sumw2 = self.values
+        self.sumw2=np.asarray(sumw2, dtype=np.float64)
+        self.title=title
+        self.xtitle=xtitle
+        self.ytitle=ytitle
+        self.sumw=sumw
+        self.sumwx=sumwx
+        self.entries=entries
+
+
+    def centers(self):
+        return 0.5*(self.edges[1:]+self.edges[:-1])
+
+
+    def mean(self):
+        # same as TH1::GetMean(1): stored statistics if there are any, bin centers otherwise
+        if self.sumw:
+            return self.sumwx/self.sumw
+        w = self.values[1:-1]
+        if w.sum() == 0:
+            return 0.0
+        return float((w*self.centers()).sum()/w.sum())
+
+
+    def pdata(self):
+        # same line as uhist.hist.pdata, from the arrays
+        inner = self.values[1:-1]
+        binmax = int(np.argmax(inner))
+        x_max = float(self.centers()[binmax])
+        y_max = float(inner[binmax])
+        return "{}: Max: ({},{}), Mean: {}\n".format(self.name, x_max, y_max, float(self.mean()))
+
+
+def open_file(path, stream=False):
+    # memory-map local files so the key data is paged in by the OS instead of
+    # copied through read() calls; remote paths get uproot's default handler
+    # every key is read once, so uproot's object/array caches only hold on to memory
+    # stream: no memory map either, the mapped pages of a big file count towards RSS
+    if "://" in str(path) or stream:
+        return uproot.open(path, object_cache=None, array_cache=None)
+    return uproot.open(path, handler=uproot.MemmapSource, object_cache=None, array_cache=None)
+
+
+def keys(f, filt=None):
+    # histogram names in file order, one entry per name like f.GetListOfKeys() in uhist.py
+    # subdirectories are walked as well ("loose/m_bb"), filt: optional keyfilter.keyfilter
+    return list(keyfilter.walk_uproot(f, filt))
+
+
+def to_hdata(obj, name):
+    ax = obj.member("fXaxis")
+    stats = {}
+    for m in ("fTsumw", "fTsumwx", "fEntries"):
+        stats[m] = obj.member(m) if obj.has_member(m) else None
+    return hdata(name, obj.axis().edges(), obj.values(flow=True), obj.variances(flow=True),
+                 title=obj.member("fTitle"), xtitle=ax.member("fTitle"),
+                 ytitle=obj.member("fYaxis").member("fTitle"),
+                 sumw=stats["fTsumw"], sumwx=stats["fTsumwx"], entries=stats["fEntries"])
+
+
+def read_hist(f, name):
+    return to_hdata(f[name], name)
+
+
+def iter_hists(f, names=None):
+    if names is None:
+        names = keys(f)
+    for name in names:
+        yield read_hist(f, name)
+
+
+def summary(input_file, out, filt=None, stream=False):
+    # histoinfo.txt without ROOT, one pdata line per histogram
+    with open_file(input_file, stream) as f:
+        out.write('New contents\n')
+        n = 0
+        for h in iter_hists(f, keys(f, filt)):
+            out.write(h.pdata())
+            n += 1
+    return n
+
+
+def uniform(edges):
+    width = np.diff(edges)
+    return np.allclose(width, width[0])
+
+
+def to_uproot(h):
+    # hdata -> uproot TH1D model, for writing with uproot
+    from uproot.writing.identify import to_TH1x, to_TAxis
+    nb = len(h.edges) - 1
+    fxbins = None if uniform(h.edges) else h.edges
+    xaxis = to_TAxis("xaxis", h.xtitle, nb, h.edges[0], h.edges[-1], fXbins=fxbins)
+    yaxis = to_TAxis("yaxis", h.ytitle, 1, 0.0, 1.0)
+    inner = h.values[1:-1]
+    centers = h.centers()
+    sumw = h.sumw if h.sumw is not None else float(inner.sum())
+    sumwx = h.sumwx if h.sumwx is not None else float((inner*centers).sum())
+    entries = h.entries if h.entries is not None else float(h.values.sum())
+    # name may carry a directory ("loose/m_bb"), the object itself only gets the last part
+    name = h.name.split("/")[-1]
+    return to_TH1x(name, h.title or name, h.values, entries, sumw, float(h.sumw2[1:-1].sum()),
+                   sumwx, float((inner*centers**2).sum()), h.sumw2, xaxis, fYaxis=yaxis)
+
+
+def write_hists(path, hists):
+    # hdata list -> ROOT file uhist.py can read as its input
+    with uproot.recreate(path) as fout:
+        for h in hists:
+            fout[h.name] = to_uproot(h)
+
+
+def to_th1(h):
+    # hdata -> ROOT TH1D, so it can go straight into uhist.hist
+    import ROOT
+    h1 = ROOT.TH1D(h.name, h.title or h.name, len(h.edges) - 1, np.ascontiguousarray(h.edges))
+    h1.SetDirectory(0)
+    h1.Sumw2()
+    for i in range(len(h.values)):
+        h1.SetBinContent(i, h.values[i])
+        h1.SetBinError(i, np.sqrt(h.sumw2[i]))
+    h1.SetEntries(h.entries if h.entries is not None else h.values.sum())
+    h1.GetXaxis().SetTitle(h.xtitle)
+    h1.GetYaxis().SetTitle(h.ytitle)
+    return h1
@@ -0,0 +1,133 @@
+import argparse
+import time
+import numpy as np
+import uproot
+import histio
+import keyfilter
+import ntuple
+
+# hadd replacement for the per-shard analysis outputs
+# walks the keys one at a time like the GetListOfKeys/Get loop in uhist.py: for each
+# histogram the shards are read one after the other and added into a single accumulator,
+# so only one key (one shard copy + the running sum) is ever in memory; the shards are
+# opened through histio.open_file, without uproot's per-file object cache
+# region directories are walked too, "loose/m_bb" lands in loose/ of the output
+# the ntuple is copied chunk by chunk with ntuple.iterate
+
+
+def key_list(files):
+    # union of the histogram and tree paths, subdirectories included, first-seen order,
+    # path -> classname
+    out = {}
+    for f in files:
+        for name in keyfilter.walk_uproot(f, None, ("TH1", "TTree")):
+            if name not in out:
+                out[name] = f.classname_of(name)
+    return out
+
+
+def merge_hist(files, name):
+    total = None
+    nread = 0
+    for f in files:
+        if name not in f:
+            continue
+        nread += f.key(name).data_compressed_bytes
+        h = histio.read_hist(f, name)
+        if total is None:
+            total = h
+            continue
+        if len(h.edges) != len(total.edges) or not np.allclose(h.edges, total.edges):
+            raise ValueError("{} has different binning in {}".format(name, f.file_path))
+        total.values += h.values
+        total.sumw2 += h.sumw2
+        for m in ("sumw", "sumwx", "entries"):
+            a, b = getattr(total, m), getattr(h, m)
+            setattr(total, m, None if a is None or b is None else a + b)
+    return total, nread
+
+
+def branch_types(t):
+    # branch -> type for mktree: the numpy dtype of flat branches, the awkward type
+    # ("var * float32") of jagged ones (std::vector<T>, or T[n] with a counter branch);
+    # counter branches are left out, uproot writes them again for the jagged branches
+    types = {}
+    counters = set()
+    for b in t.keys():
+        interp = t[b].interpretation
+        if isinstance(interp, uproot.interpretation.jagged.AsJagged):
+            types[b] = "var * " + interp.content.numpy_dtype.newbyteorder("=").name
+            if t[b].count_branch is not None:
+                counters.add(t[b].count_branch.name)
+        elif isinstance(interp, uproot.interpretation.numerical.AsDtype):
+            types[b] = interp.numpy_dtype.newbyteorder("=")
+        else:
+            raise TypeError("{} in {}: cannot merge branches read as {}".format(b, t.object_path, interp))
+    return {b: v for b, v in types.items() if b not in counters}
+
+
+def merge_tree(paths, files, name, fout, step_size):
+    nread = 0
+    nevents = 0
+    tree = None
+    library = "np"
+    for p, f in zip(paths, files):
+        if name not in f:
+            continue
+        t = f[name]
+        nread += t.compressed_bytes
+        if tree is None:
+            types = branch_types(t)
+            branches = list(types)
+            tree = fout.mktree(name, types)
+            # jagged branches only keep their type as awkward arrays
+            if any(isinstance(v, str) for v in types.values()):
+                library = "ak"
+        for chunk in ntuple.iterate(p, branches, step_size=step_size, tree=name, library=library):
+            tree.extend({b: chunk[b] for b in branches})
+            nevents += len(chunk[branches[0]])
+    return nread, nevents
+
+
+def merge(paths, target, step_size=100000, verbose=True):
+    paths = ntuple.expand(paths)
+    start = time.time()
+    files = [histio.open_file(p) for p in paths]
+    nread = 0
+    nkeys = 0
+    nevents = 0
+    try:
+        keys = key_list(files)
+        with uproot.recreate(target) as fout:
+            for name, classname in keys.items():
+                if classname.startswith("TH1"):
+                    h, n = merge_hist(files, name)
+                    fout[name] = histio.to_uproot(h)
+                elif classname == "TTree":
+                    n, ne = merge_tree(paths, files, name, fout, step_size)
+                    nevents += ne
+                else:
+                    print("Skipping {} ({}), not a TH1 or TTree".format(name, classname))
+                    continue
+                nread += n
+                nkeys += 1
+    finally:
+        for f in files:
+            f.close()
+    took = time.time() - start
+    stats = {"files": len(paths), "keys": nkeys, "events": nevents, "seconds": took,
+             "mb_read": nread/1e6, "mb_per_s": nread/1e6/took if took > 0 else 0.,
+             "keys_per_s": nkeys/took if took > 0 else 0.}
+    if verbose:
+        print("Merged {files} files, {keys} keys, {events} ntuple entries in {seconds:.1f}s "
+              "({mb_read:.1f} MB read, {mb_per_s:.1f} MB/s, {keys_per_s:.1f} keys/s)".format(**stats))
+    return stats
+
+
+if __name__=="__main__":
+    parser = argparse.ArgumentParser(description="streaming merge of per-shard analysis outputs")
+    parser.add_argument("-o", "--output", required=True)
+    parser.add_argument("inputs", nargs="+", help="shard outputs (globs allowed)")
+    parser.add_argument("--step", type=int, default=100000, help="ntuple entries per chunk")
+    args = parser.parse_args()
+    merge(args.inputs, args.output, args.step)
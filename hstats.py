@@ -0,0 +1,119 @@
+import csv
+import json
+import numpy as np
+
+# batch statistics for many histograms at once
+# histograms with the same binning are stacked into one (nhist, nbins+2) array and
+# every column below is computed for the whole stack in one go
+# a table is a dict of column name -> numpy array (one row per histogram), "name" included
+
+quantiles = (0.16, 0.5, 0.84)
+columns = ["name", "nbins", "xmin", "xmax", "mode", "max", "mean", "rms", "integral", "underflow_frac", "overflow_frac"] + ["q{:02d}".format(int(round(q*100))) for q in quantiles]
+
+
+def group(hists):
+    # same-binning groups, in the order the first member of each group was seen
+    groups = {}
+    for h in hists:
+        groups.setdefault(h.edges.tobytes(), []).append(h)
+    return list(groups.values())
+
+
+def wquantiles(w, edges, qs):
+    # weighted quantiles from the binned cdf, linear inside the bin where it crosses q
+    # negative weights would make the cdf non monotonic so they are clipped for this
+    w = np.clip(w, 0, None)
+    total = w.sum(axis=1, keepdims=True)
+    p = w / np.where(total > 0, total, 1)
+    cdf = np.cumsum(p, axis=1)
+    rows = np.arange(w.shape[0])
+    out = np.empty((w.shape[0], len(qs)))
+    for j, q in enumerate(qs):
+        i = np.argmax(cdf >= q - 1e-12, axis=1)
+        frac = (q - (cdf[rows, i] - p[rows, i])) / np.where(p[rows, i] > 0, p[rows, i], 1)
+        out[:, j] = edges[i] + np.clip(frac, 0, 1) * (edges[i+1] - edges[i])
+    out[total[:, 0] <= 0] = np.nan
+    return out
+
+
+def stack_stats(values, edges):
+    # values: (nhist, nbins+2) with flow bins, edges: (nbins+1,)
+    inner = values[:, 1:-1]
+    centers = 0.5*(edges[1:]+edges[:-1])
+    integral = inner.sum(axis=1)
+    total = values.sum(axis=1)
+    safe = np.where(integral != 0, integral, 1)
+    safe_total = np.where(total != 0, total, 1)
+    binmax = np.argmax(inner, axis=1)
+    mean = (inner*centers).sum(axis=1) / safe
+    var = (inner*(centers - mean[:, None])**2).sum(axis=1) / safe
+    stats = {
+        "nbins": np.full(len(values), len(centers)),
+        "xmin": np.full(len(values), edges[0]),
+        "xmax": np.full(len(values), edges[-1]),
+        "mode": centers[binmax],
+        "max": inner[np.arange(len(values)), binmax],
+        "mean": np.where(integral != 0, mean, 0.),
+        "rms": np.sqrt(np.clip(var, 0, None)),
+        "integral": integral,
+        "underflow_frac": np.where(total != 0, values[:, 0]/safe_total, 0.),
+        "overflow_frac": np.where(total != 0, values[:, -1]/safe_total, 0.),
+    }
+    qs = wquantiles(inner, edges, quantiles)
+    for j, c in enumerate(columns[-len(quantiles):]):
+        stats[c] = qs[:, j]
+    return stats
+
+
+def table(hists):
+    # one row per histogram, rows kept in input order
+    hists = list(hists)
+    order = {id(h): i for i, h in enumerate(hists)}
+    out = {c: np.empty(len(hists), dtype=object if c == "name" else np.float64) for c in columns}
+    for g in group(hists):
+        rows = np.array([order[id(h)] for h in g])
+        stats = stack_stats(np.stack([h.values for h in g]), g[0].edges)
+        out["name"][rows] = [h.name for h in g]
+        for c, v in stats.items():
+            out[c][rows] = v
+    out["name"] = out["name"].astype(str)
+    out["nbins"] = out["nbins"].astype(np.int64)
+    return out
+
+
+def write_csv(tab, path):
+    with open(path, "w", newline="") as fout:
+        w = csv.writer(fout)
+        w.writerow(columns)
+        for i in range(len(tab["name"])):
+            w.writerow([tab[c][i].item() if c != "name" else tab[c][i] for c in columns])
+
+
+def jvalue(v):
+    # json has no NaN, empty histograms get null quantiles
+    v = v.item()
+    if isinstance(v, float) and v != v:
+        return None
+    return v
+
+
+def write_json(tab, path):
+    rows = [{c: (jvalue(tab[c][i]) if c != "name" else str(tab[c][i])) for c in columns} for i in range(len(tab["name"]))]
+    with open(path, "w") as fout:
+        json.dump(rows, fout, indent=1)
+
+
+def write_npz(tab, path):
+    # binary columnar: one array per column, np.load(path)["mean"] etc.
+    np.savez(path, **{c: tab[c] for c in columns})
+
+
+def write_table(tab, path):
+    if path.endswith(".csv"):
+        write_csv(tab, path)
+    elif path.endswith(".json"):
+        write_json(tab, path)
+    elif path.endswith(".npz"):
+        write_npz(tab, path)
+    else:
+        raise ValueError("unknown table format for {}, use .csv, .json or .npz".format(path))
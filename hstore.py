@@ -0,0 +1,147 @@
+import argparse
+import json
+import os
+import shutil
+import time
+import numpy as np
+import histio
+
+# columnar store of all histograms of a file, for random access without ROOT and
+# without reading through uproot
+# a store is a directory of flat arrays, every histogram a slice of each:
+#   edges.npy   float64, all bin edges back to back
+#   values.npy  float64, all contents (flow bins included) back to back
+#   sumw2.npy   float64, same layout as values
+#   offsets.npy int64 (n+1, 2): start of histogram i in edges (column 0) and in values (1)
+#   stats.npy   float64 (n, 3): sumw, sumwx, entries (nan if unknown)
+#   index.json  names, regions and titles in the order of the arrays
+# the arrays are opened with np.load(mmap_mode="r"), so opening only maps the files
+# and a lookup is a dict access plus slicing, the pages are read when touched
+
+version = 1
+arrays = ("edges", "values", "sumw2", "offsets", "stats")
+
+
+def split_name(name):
+    # "loose/m_bb" -> ("loose", "m_bb"), top level keys are in region ""
+    region, _, var = name.rpartition("/")
+    return region, var
+
+
+def write(path, hists):
+    # hdata list -> store at path, written next to it first and renamed into place
+    hists = list(hists)
+    n = len(hists)
+    offsets = np.zeros((n + 1, 2), dtype=np.int64)
+    for i, h in enumerate(hists):
+        offsets[i + 1] = offsets[i] + (len(h.edges), len(h.values))
+    data = {
+        "edges": np.concatenate([h.edges for h in hists]) if n else np.zeros(0),
+        "values": np.concatenate([h.values for h in hists]) if n else np.zeros(0),
+        "sumw2": np.concatenate([h.sumw2 for h in hists]) if n else np.zeros(0),
+        "offsets": offsets,
+        "stats": np.array([[np.nan if v is None else v for v in (h.sumw, h.sumwx, h.entries)] for h in hists], dtype=np.float64).reshape(n, 3),
+    }
+    index = {"version": version, "names": [h.name for h in hists],
+             "titles": [[h.title, h.xtitle, h.ytitle] for h in hists]}
+    tmp = path.rstrip("/") + ".tmp"
+    shutil.rmtree(tmp, ignore_errors=True)
+    os.makedirs(tmp)
+    for k in arrays:
+        np.save(os.path.join(tmp, k + ".npy"), data[k])
+    with open(os.path.join(tmp, "index.json"), "w") as fout:
+        json.dump(index, fout)
+    shutil.rmtree(path, ignore_errors=True)
+    os.rename(tmp, path)
+    return n
+
+
+class store:
+
+    def __init__(self, path):
+        with open(os.path.join(path, "index.json")) as fin:
+            index = json.load(fin)
+        if index.get("version") != version:
+            raise ValueError("{} is a version {} store, expected {}".format(path, index.get("version"), version))
+        self.path = path
+        self.names = index["names"]
+        self.titles = index["titles"]
+        self.pos = {name: i for i, name in enumerate(self.names)}
+        self.regions = {}
+        for name in self.names:
+            region, var = split_name(name)
+            self.regions.setdefault(region, {})[var] = self.pos[name]
+        for k in arrays:
+            setattr(self, k, np.load(os.path.join(path, k + ".npy"), mmap_mode="r"))
+
+
+    def __len__(self):
+        return len(self.names)
+
+
+    def __contains__(self, name):
+        return name in self.pos
+
+
+    def __getitem__(self, name):
+        return self.get(name)
+
+
+    def get(self, name, region=None):
+        # region given: name is the variable within it, get("m_bb", "loose") = get("loose/m_bb")
+        i = self.regions[region][name] if region is not None else self.pos[name]
+        e0, v0 = self.offsets[i]
+        e1, v1 = self.offsets[i + 1]
+        sumw, sumwx, entries = (None if np.isnan(v) else float(v) for v in self.stats[i])
+        title, xtitle, ytitle = self.titles[i]
+        # slices of the memory maps, nothing is copied
+        return histio.hdata(self.names[i], self.edges[e0:e1], self.values[v0:v1], self.sumw2[v0:v1],
+                            title=title, xtitle=xtitle, ytitle=ytitle, sumw=sumw, sumwx=sumwx, entries=entries)
+
+
+    def region(self, region):
+        # variable -> hdata for every histogram of a region
+        return {var: self.get(var, region) for var in self.regions[region]}
+
+
+def export(input_file, path, filt=None, titles=None):
+    # every (matching) histogram of a ROOT file into a store; titles: variable ->
+    # x axis title to store instead of the one in the file (uhist.xname)
+    hists = []
+    with histio.open_file(input_file) as f:
+        for h in histio.iter_hists(f, histio.keys(f, filt)):
+            if titles is not None:
+                h.xtitle = titles.get(split_name(h.name)[1], "No X-axis title")
+            hists.append(h)
+    return write(path, hists)
+
+
+def access_time(path, lookups=10000, seed=0):
+    # mean seconds of one open-free random lookup that touches the bin contents
+    s = store(path)
+    rng = np.random.default_rng(seed)
+    order = [s.names[i] for i in rng.integers(0, len(s), lookups)]
+    t = time.perf_counter()
+    for name in order:
+        float(s.get(name).values.sum())
+    return (time.perf_counter() - t)/max(lookups, 1)
+
+
+if __name__=="__main__":
+    parser = argparse.ArgumentParser(description="memory mapped histogram store")
+    parser.add_argument("store", help="store directory")
+    parser.add_argument("-i", "--input", help="ROOT file to export into the store first")
+    parser.add_argument("--region", help="only list the histograms of this region")
+    parser.add_argument("--timing", type=int, nargs="?", const=10000, help="time this many random lookups")
+    args = parser.parse_args()
+
+    if args.input:
+        n = export(args.input, args.store)
+        print("Exported {} histograms to {}".format(n, args.store))
+    s = store(args.store)
+    names = s.names if args.region is None else ["{}/{}".format(args.region, v) if args.region else v for v in s.regions[args.region]]
+    for name in names:
+        print(s.get(name).pdata(), end="")
+    print("{} histograms in {} regions".format(len(s), len(s.regions)))
+    if args.timing:
+        print("{:.1f} us per random lookup".format(1e6*access_time(args.store, args.timing)))
@@ -0,0 +1,73 @@
+import fnmatch
+import re
+
+# include/exclude filters over key paths and lazy traversal of (nested) ROOT files
+# keys in subdirectories are named by their path, "loose/m_bb" like TFile::Get takes them
+# a pattern is a glob ("dR_*", "loose/*") or, prefixed with "re:", a regular expression
+# searched in the path ("re:^SR[12]/m_"); a glob without a "/" is matched against the
+# last part of the path only, so "dR_*" picks the dR histograms of every region
+# only key metadata is read while walking, objects are deserialized by the caller for
+# the matching paths alone
+
+
+class pattern:
+
+    def __init__(self, text):
+        self.text = text
+        if text.startswith("re:"):
+            self.regex = re.compile(text[3:])
+            self.glob = None
+        else:
+            self.regex = None
+            self.glob = text
+
+
+    def match(self, path):
+        if self.regex is not None:
+            return self.regex.search(path) is not None
+        if "/" not in self.glob:
+            path = path.rpartition("/")[2]
+        return fnmatch.fnmatchcase(path, self.glob)
+
+
+class keyfilter:
+    # a path passes if it matches any include (or there are none) and no exclude
+
+    def __init__(self, include=(), exclude=()):
+        self.include = [pattern(p) for p in include]
+        self.exclude = [pattern(p) for p in exclude]
+
+
+    def __bool__(self):
+        return bool(self.include or self.exclude)
+
+
+    def match(self, path):
+        if self.include and not any(p.match(path) for p in self.include):
+            return False
+        return not any(p.match(path) for p in self.exclude)
+
+
+def walk_root(d, filt=None, prefix=""):
+    # PyROOT TDirectory -> key paths in file order, recursing into subdirectories
+    # only directories are read (for their key lists), never the objects themselves
+    seen = set()
+    for key in d.GetListOfKeys():
+        name = key.GetName()
+        if name in seen:
+            continue
+        seen.add(name)
+        path = prefix + name
+        if key.IsFolder() and key.GetClassName().startswith("TDirectory"):
+            for sub in walk_root(key.ReadObj(), filt, path + "/"):
+                yield sub
+        elif filt is None or filt.match(path):
+            yield path
+
+
+def walk_uproot(f, filt=None, classes=("TH1",)):
+    # uproot directory -> paths of the objects whose class starts with one of classes
+    # classnames() only reads the directory headers
+    for path, classname in f.classnames(recursive=True, cycle=False).items():
+        if classname.startswith(classes) and (filt is None or filt.match(path)):
+            yield path
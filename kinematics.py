@@ -0,0 +1,333 @@
+import argparse
+import math
+import os
+import tempfile
+import numpy as np
+import features
+import ntuple
+
+# batched versions of the event level variables of VBS::ProcessEvent, over whole
+# arrays of events at once instead of one event at a time in C++
+# inputs are flat object kinematics per collection, like features.py: pt, eta, phi,
+# m and offsets with nevents+1 entries, objects pt ordered within every event as
+# SimpleAnalysis returns them; jets also carry "btag" (pass BTag77MV2c10)
+#   jets: the signal jets, electrons/muons/taus: the signal leptons
+#   met, met_phi: one value per event
+# the sentinels are the C++ ones: -999 where VBS.cxx initialises a variable to -999
+# and skips the assignment, 999 from minDphi without jets, and a default constructed
+# TLorentzVector (pt, phi and mass 0) for the Z when the event has no Z pair
+
+missing = features.missing
+# minDphi starts from 999 and keeps it when there is no object to compare with
+no_dphi = 999.
+# filterObjects(signalJets, 30., 5, BTag77MV2c10) for the b / non-b jets
+bjet_pt = 30.
+bjet_eta = 5.
+
+
+def event_index(offsets):
+    offsets = np.asarray(offsets, dtype=np.int64)
+    return np.repeat(np.arange(len(offsets) - 1), np.diff(offsets))
+
+
+def select(coll, mask):
+    # the objects of a collection passing mask, still pt ordered, with new offsets
+    offsets = np.asarray(coll["offsets"], dtype=np.int64)
+    mask = np.asarray(mask, dtype=bool)
+    n = len(offsets) - 1
+    counts = np.bincount(event_index(offsets)[mask], minlength=n)
+    out = {k: np.asarray(v)[mask] for k, v in coll.items() if k != "offsets"}
+    out["offsets"] = np.concatenate([[0], np.cumsum(counts)])
+    return out
+
+
+def split_bjets(jets, pt=bjet_pt, eta=bjet_eta):
+    # (bjets, nonbjets) like the two filterObjects calls in VBS.cxx
+    base = (np.asarray(jets["pt"]) >= pt) & (np.abs(np.asarray(jets["eta"])) < eta)
+    btag = np.asarray(jets["btag"], dtype=bool)
+    return select(jets, base & btag), select(jets, base & ~btag)
+
+
+def counts(coll):
+    return np.diff(np.asarray(coll["offsets"], dtype=np.int64))
+
+
+def sum_pt(coll, n=None):
+    # sumObjectsPt(objects, n)
+    if n is not None:
+        return np.nan_to_num(features.pad(coll["pt"], coll["offsets"], n)).sum(axis=0)
+    nev = len(coll["offsets"]) - 1
+    return np.bincount(event_index(coll["offsets"]), weights=np.asarray(coll["pt"], dtype=np.float64), minlength=nev)
+
+
+def four_vectors(coll, n):
+    # px, py, pz, e of the leading n objects, (n, nevents), nan where there is none
+    pt = features.pad(coll["pt"], coll["offsets"], n)
+    eta = features.pad(coll["eta"], coll["offsets"], n)
+    phi = features.pad(coll["phi"], coll["offsets"], n)
+    m = features.pad(coll["m"], coll["offsets"], n) if "m" in coll else np.zeros_like(pt)
+    px, py, pz = pt*np.cos(phi), pt*np.sin(phi), pt*np.sinh(eta)
+    return px, py, pz, np.sqrt(px*px + py*py + pz*pz + m*m)
+
+
+def signed_mass(e, px, py, pz):
+    # TLorentzVector::M, negative for a negative mass squared
+    m2 = e*e - px*px - py*py - pz*pz
+    return np.sign(m2)*np.sqrt(np.abs(m2))
+
+
+def pair_mass(coll):
+    # (o[0] + o[1]).M() of the two leading objects, -999 with fewer than two
+    px, py, pz, e = four_vectors(coll, 2)
+    m = signed_mass(e[0] + e[1], px[0] + px[1], py[0] + py[1], pz[0] + pz[1])
+    return np.where(counts(coll) > 1, m, missing)
+
+
+def delta_phi(a, b):
+    # TVector2::Phi_mpi_pi(a - b)
+    return np.mod(a - b + np.pi, 2*np.pi) - np.pi
+
+
+def min_dphi(met_phi, coll, n):
+    # minDphi(metVec, objects, n): smallest |dphi| to the leading n objects
+    phi = features.pad(coll["phi"], coll["offsets"], n)
+    d = np.abs(delta_phi(np.asarray(met_phi, dtype=np.float64)[None, :], phi))
+    return np.where(np.isnan(d), no_dphi, d).min(axis=0)
+
+
+def mt_min(coll, met, met_phi, n=None):
+    # calcMTmin(objects, metVec): smallest sqrt(|2 pt met (1 - cos dphi)|) over the
+    # (leading n) objects, -999 without any; VBS.cxx only calls it with bjets
+    met = np.asarray(met, dtype=np.float64)
+    met_phi = np.asarray(met_phi, dtype=np.float64)
+    offsets = np.asarray(coll["offsets"], dtype=np.int64)
+    evt = event_index(offsets)
+    pt = np.asarray(coll["pt"], dtype=np.float64)
+    phi = np.asarray(coll["phi"], dtype=np.float64)
+    keep = np.ones(len(pt), dtype=bool) if n is None else (np.arange(len(pt)) - offsets[evt]) < n
+    mt = np.sqrt(np.abs(2*pt*met[evt]*(1 - np.cos(phi - met_phi[evt]))))
+    out = np.full(len(offsets) - 1, np.inf)
+    np.minimum.at(out, evt[keep], mt[keep])
+    return np.where(np.isinf(out), missing, out)
+
+
+def mct(coll):
+    # calcMCT(o[0], o[1]) of the two leading objects, -999 with fewer than two
+    px, py, pz, e = four_vectors(coll, 2)
+    et = e/np.sqrt(1 + (pz/np.hypot(px, py))**2)
+    m2 = (et[0] + et[1])**2 - (px[0] - px[1])**2 - (py[0] - py[1])**2
+    return np.where(counts(coll) > 1, np.sqrt(np.abs(m2)), missing)
+
+
+def z_candidate(electrons, muons):
+    # tlv_Z of the Z+jets CR: the two signal electrons (and no muon) or the two signal
+    # muons (and no electron), else an empty TLorentzVector; returns (pt, phi, mass)
+    ne, nm = counts(electrons), counts(muons)
+    ee = (ne == 2) & (nm < 1)
+    mm = (nm == 2) & (ne < 1)
+    zp = [np.zeros(len(ne)) for i in range(4)]
+    for coll, sel in ((electrons, ee), (muons, mm)):
+        px, py, pz, e = four_vectors(coll, 2)
+        for k, v in enumerate((px, py, pz, e)):
+            zp[k] = np.where(sel, v[0] + v[1], zp[k])
+    px, py, pz, e = zp
+    return np.hypot(px, py), np.arctan2(py, px), signed_mass(e, px, py, pz)
+
+
+def compute(jets, electrons, muons, taus, met, met_phi, bjets=None, nonbjets=None):
+    # every variable of VBS::ProcessEvent this covers, name -> (nevents,) array
+    met = np.asarray(met, dtype=np.float64)
+    met_phi = np.asarray(met_phi, dtype=np.float64)
+    if bjets is None or nonbjets is None:
+        bjets, nonbjets = split_bjets(jets)
+    out = {}
+    out["meff_incl"] = met + sum_pt(jets) + sum_pt(electrons) + sum_pt(muons) + sum_pt(taus)
+    out["meff_4j"] = met + sum_pt(jets, 4)
+    out["mTb_min"] = mt_min(bjets, met, met_phi)
+    out["mCT_bb"] = mct(bjets)
+    out["dphi_min"] = min_dphi(met_phi, jets, 4)
+    out["dphi_1jet"] = min_dphi(met_phi, jets, 1)
+    out["m_bb"] = pair_mass(bjets)
+    out["m_non_bb"] = pair_mass(nonbjets)
+    z_pt, z_phi, out["Z_mass"] = z_candidate(electrons, muons)
+    zx = met*np.cos(met_phi) + z_pt*np.cos(z_phi)
+    zy = met*np.sin(met_phi) + z_pt*np.sin(z_phi)
+    out["ZCR_met"] = np.hypot(zx, zy)
+    out["ZCR_meff_4j"] = out["ZCR_met"] + sum_pt(jets, 4)
+    # the C++ variables are floats
+    return {k: v.astype(np.float32) for k, v in out.items()}
+
+
+# object collections as VBS.cxx writes them to the ntuple (ntupVar with the objects)
+ntuple_collections = {"jets": "sigjets", "electrons": "sigelectrons", "muons": "sigmuons", "taus": "sigtaus"}
+
+
+def from_chunk(chunk, prefix):
+    # jagged ntuple branches (one array per event) -> flat collection
+    pt = chunk[prefix + "_pt"]
+    n = np.array([len(x) for x in pt], dtype=np.int64)
+    coll = {"offsets": np.concatenate([[0], np.cumsum(n)])}
+    for var in ("pt", "eta", "phi", "m", "btag"):
+        if prefix + "_" + var in chunk:
+            parts = chunk[prefix + "_" + var]
+            coll[var] = np.concatenate(parts) if len(parts) else np.zeros(0)
+    return coll
+
+
+def check(paths, tree=None, step_size=100000, rtol=1e-4, atol=1e-3):
+    # compute() on the object branches against the scalar branches VBS.cxx filled
+    # for the same events; returns name -> (events, mismatches, largest difference)
+    names = ["meff_incl", "meff_4j", "mTb_min", "mCT_bb", "dphi_min", "dphi_1jet", "m_bb", "m_non_bb", "Z_mass", "ZCR_met", "ZCR_meff_4j"]
+    branches = names + ["met", "met_phi"] + ["{}_*".format(p) for p in ntuple_collections.values()]
+    res = {k: [0, 0, 0.] for k in names}
+    for chunk in ntuple.iterate(paths, branches, step_size=step_size, tree=tree):
+        colls = {k: from_chunk(chunk, p) for k, p in ntuple_collections.items()}
+        got = compute(colls["jets"], colls["electrons"], colls["muons"], colls["taus"], chunk["met"], chunk["met_phi"])
+        for k in names:
+            ref = np.asarray(chunk[k], dtype=np.float64)
+            diff = np.abs(got[k] - ref)
+            bad = diff > atol + rtol*np.abs(ref)
+            res[k][0] += len(ref)
+            res[k][1] += int(bad.sum())
+            res[k][2] = max(res[k][2], float(diff.max()) if len(diff) else 0.)
+    return res
+
+
+# scalar reference: VBS::ProcessEvent transcribed one event and one object at a time,
+# for checking compute() without a SimpleAnalysis build (make_fixture, --selftest)
+
+def objects(coll, i):
+    a, b = coll["offsets"][i], coll["offsets"][i + 1]
+    # python floats, so all the arithmetic below is in double like TLorentzVector
+    return [{k: float(coll[k][j]) for k in coll if k != "offsets"} for j in range(a, b)]
+
+
+def p4(o):
+    px, py, pz = o["pt"]*math.cos(o["phi"]), o["pt"]*math.sin(o["phi"]), o["pt"]*math.sinh(o["eta"])
+    return [px, py, pz, math.sqrt(px*px + py*py + pz*pz + o.get("m", 0.)**2)]
+
+
+def add(a, b):
+    return [x + y for x, y in zip(a, b)]
+
+
+def mass(v):
+    m2 = v[3]**2 - v[0]**2 - v[1]**2 - v[2]**2
+    return -math.sqrt(-m2) if m2 < 0 else math.sqrt(m2)
+
+
+def phi_mpi_pi(d):
+    while d >= math.pi:
+        d -= 2*math.pi
+    while d < -math.pi:
+        d += 2*math.pi
+    return d
+
+
+def et(v):
+    pt2 = v[0]**2 + v[1]**2
+    return math.sqrt(v[3]**2*pt2/(pt2 + v[2]**2))
+
+
+def reference_event(J, E, Mu, T, met, met_phi):
+    bj = [j for j in J if j["pt"] >= bjet_pt and abs(j["eta"]) < bjet_eta and j["btag"]]
+    nb = [j for j in J if j["pt"] >= bjet_pt and abs(j["eta"]) < bjet_eta and not j["btag"]]
+    r = {}
+    r["meff_incl"] = met + sum(o["pt"] for o in J + E + Mu + T)
+    r["meff_4j"] = met + sum(o["pt"] for o in J[:4])
+    mts = [math.sqrt(abs(2*b["pt"]*met*(1 - math.cos(b["phi"] - met_phi)))) for b in bj]
+    r["mTb_min"] = min(mts) if mts else missing
+    r["mCT_bb"] = r["m_bb"] = missing
+    if len(bj) > 1:
+        a, b = p4(bj[0]), p4(bj[1])
+        r["mCT_bb"] = math.sqrt(abs((et(a) + et(b))**2 - (a[0] - b[0])**2 - (a[1] - b[1])**2))
+        r["m_bb"] = mass(add(a, b))
+    r["m_non_bb"] = mass(add(p4(nb[0]), p4(nb[1]))) if len(nb) > 1 else missing
+    r["dphi_min"] = min([abs(phi_mpi_pi(met_phi - j["phi"])) for j in J[:4]] + [no_dphi])
+    r["dphi_1jet"] = min([abs(phi_mpi_pi(met_phi - j["phi"])) for j in J[:1]] + [no_dphi])
+    z = [0., 0., 0., 0.]
+    if len(E) == 2 and len(Mu) < 1:
+        z = add(p4(E[0]), p4(E[1]))
+    if len(Mu) == 2 and len(E) < 1:
+        z = add(p4(Mu[0]), p4(Mu[1]))
+    r["Z_mass"] = mass(z)
+    zpt = math.hypot(z[0], z[1])
+    zphi = math.atan2(z[1], z[0]) if zpt else 0.
+    r["ZCR_met"] = math.hypot(met*math.cos(met_phi) + zpt*math.cos(zphi), met*math.sin(met_phi) + zpt*math.sin(zphi))
+    r["ZCR_meff_4j"] = r["ZCR_met"] + sum(o["pt"] for o in J[:4])
+    return r
+
+
+def reference(jets, electrons, muons, taus, met, met_phi):
+    # same output as compute(), from reference_event
+    rows = [reference_event(objects(jets, i), objects(electrons, i), objects(muons, i), objects(taus, i), float(met[i]), float(met_phi[i]))
+            for i in range(len(met))]
+    return {k: np.array([r[k] for r in rows], dtype=np.float32) for k in rows[0]} if rows else {}
+
+
+def random_collection(rng, nevents, maxn, minn=0, btag=False):
+    # pt ordered objects per event, like SimpleAnalysis returns them
+    n = rng.integers(minn, maxn + 1, nevents)
+    offsets = np.concatenate([[0], np.cumsum(n)])
+    pt = rng.exponential(80, n.sum()) + 5
+    evt = event_index(offsets)
+    order = np.lexsort((-pt, evt))
+    coll = {"offsets": offsets, "pt": pt[order].astype(np.float32),
+            "eta": rng.uniform(-3, 3, n.sum()).astype(np.float32),
+            "phi": rng.uniform(-np.pi, np.pi, n.sum()).astype(np.float32),
+            "m": rng.uniform(0, 15, n.sum()).astype(np.float32)}
+    if btag:
+        coll["btag"] = (rng.random(n.sum()) < 0.4).astype(np.int32)
+    return coll
+
+
+def make_fixture(path, nevents=2000, seed=5):
+    # an ntuple shaped like the VBS.cxx output: the sig* object branches and met, with
+    # the scalar variables filled by the scalar reference in place of the C++ code
+    import awkward as ak
+    import uproot
+    rng = np.random.default_rng(seed)
+    colls = {"jets": random_collection(rng, nevents, 9, 4, btag=True), "electrons": random_collection(rng, nevents, 3),
+             "muons": random_collection(rng, nevents, 3), "taus": random_collection(rng, nevents, 1)}
+    met = (rng.exponential(150, nevents)).astype(np.float32)
+    met_phi = rng.uniform(-np.pi, np.pi, nevents).astype(np.float32)
+    d = {"met": met, "met_phi": met_phi}
+    d.update(reference(colls["jets"], colls["electrons"], colls["muons"], colls["taus"], met, met_phi))
+    types = {k: v.dtype for k, v in d.items()}
+    for k, prefix in ntuple_collections.items():
+        coll = colls[k]
+        for var in ("pt", "eta", "phi", "m", "btag"):
+            if var in coll:
+                d[prefix + "_" + var] = ak.unflatten(coll[var], np.diff(coll["offsets"]))
+                types[prefix + "_" + var] = "var * " + coll[var].dtype.name
+    with uproot.recreate(path) as fout:
+        fout.mktree(ntuple.tree_name, types)
+        fout[ntuple.tree_name].extend(d)
+    return path
+
+
+if __name__=="__main__":
+    parser = argparse.ArgumentParser(description="check the batched kernels against the VBS.cxx ntuple variables")
+    parser.add_argument("inputs", nargs="*", help="analysis outputs with the ntuple, including the sigjets_* ... object branches")
+    parser.add_argument("--selftest", type=int, nargs="?", const=2000, help="check against a generated fixture of this many events, filled by the scalar reference")
+    parser.add_argument("--rtol", type=float, default=1e-4)
+    parser.add_argument("--atol", type=float, default=1e-3)
+    args = parser.parse_args()
+
+    inputs = args.inputs
+    tmp = None
+    if args.selftest:
+        tmp = tempfile.mkdtemp(prefix="kinematics_")
+        inputs = [make_fixture(os.path.join(tmp, "fixture.root"), args.selftest)]
+    elif not inputs:
+        parser.error("no inputs (or --selftest)")
+    res = check(inputs, rtol=args.rtol, atol=args.atol)
+    if tmp is not None:
+        os.remove(inputs[0])
+        os.rmdir(tmp)
+    failed = 0
+    for k, (n, bad, worst) in res.items():
+        print("{:<12} {:>10d} events {:>8d} mismatches  max diff {:.3g}".format(k, n, bad, worst))
+        failed += bad
+    if failed:
+        raise SystemExit(1)
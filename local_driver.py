@@ -0,0 +1,150 @@
+import argparse
+import glob
+import os
+import shlex
+import shutil
+import subprocess
+import sys
+import time
+
+# local replacement for local_sub.sh: shards the DAOD inputs over N concurrent
+# simpleAnalysis processes, retries failed shards and merges the outputs into one VBS.root
+# (with hmerge.py, or hadd with --hadd)
+# every shard runs in its own directory (shard_XXX) so the outputs and logs don't collide
+
+
+def expand(inputs):
+    # files, globs, comma joined lists (like local_sub.sh) or @list.txt files
+    files = []
+    for arg in inputs:
+        if arg.startswith("@"):
+            with open(arg[1:]) as fin:
+                files += expand([l.strip() for l in fin if l.strip() and not l.startswith("#")])
+            continue
+        for part in arg.split(","):
+            matches = sorted(glob.glob(part))
+            files += matches if matches else [part]
+    return files
+
+
+def make_shards(files, nshards):
+    # round robin so every shard gets a similar mix of files
+    nshards = max(1, min(nshards, len(files)))
+    return [files[i::nshards] for i in range(nshards)]
+
+
+class shard:
+
+    def __init__(self, index, files, workdir):
+        self.index = index
+        self.files = files
+        self.dir = os.path.join(workdir, "shard_{:03d}".format(index))
+        self.attempts = 0
+        self.proc = None
+        self.log = None
+        self.start = None
+        self.status = "pending"
+
+
+    def launch(self, analysis, extra):
+        os.makedirs(self.dir, exist_ok=True)
+        # a failed attempt may have left a half written output behind
+        if os.path.exists(self.output(analysis)):
+            os.remove(self.output(analysis))
+        self.attempts += 1
+        self.log = open(os.path.join(self.dir, "log_{}.txt".format(self.attempts)), "w")
+        cmd = ["simpleAnalysis", "-a", analysis] + extra + [",".join(os.path.abspath(f) for f in self.files)]
+        self.log.write(" ".join(cmd) + "\n")
+        self.log.flush()
+        self.proc = subprocess.Popen(cmd, cwd=self.dir, stdout=self.log, stderr=subprocess.STDOUT)
+        self.start = time.time()
+        self.status = "running"
+
+
+    def output(self, analysis):
+        return os.path.join(self.dir, analysis + ".root")
+
+
+    def poll(self, analysis):
+        rc = self.proc.poll()
+        if rc is None:
+            return None
+        self.log.close()
+        if rc == 0 and os.path.exists(self.output(analysis)):
+            self.status = "done"
+        else:
+            self.status = "failed"
+        return rc
+
+
+def run_shards(shards, jobs, retries, analysis, extra, poll=1.0):
+    queue = list(shards)
+    running = []
+    while queue or running:
+        while queue and len(running) < jobs:
+            s = queue.pop(0)
+            s.launch(analysis, extra)
+            running.append(s)
+        time.sleep(poll)
+        for s in list(running):
+            rc = s.poll(analysis)
+            if rc is None:
+                continue
+            running.remove(s)
+            took = time.time() - s.start
+            if s.status == "failed" and s.attempts <= retries:
+                print("shard {:03d} failed (rc={}, {:.0f}s), retry {}/{}".format(s.index, rc, took, s.attempts, retries))
+                s.status = "pending"
+                queue.append(s)
+            else:
+                print("shard {:03d} {} (rc={}, {:.0f}s, {} files)".format(s.index, s.status, rc, took, len(s.files)))
+        ndone = sum(s.status == "done" for s in shards)
+        nfail = sum(s.status == "failed" for s in shards)
+        sys.stdout.write("\r[{}/{} done, {} failed, {} running, {} queued]".format(ndone, len(shards), nfail, len(running), len(queue)))
+        sys.stdout.flush()
+    print("")
+    return [s for s in shards if s.status == "failed"]
+
+
+def merge(outputs, target, hadd=False):
+    # hmerge streams key by key, hadd loads whole objects per file
+    if not hadd:
+        import hmerge
+        hmerge.merge(outputs, target)
+        return
+    if shutil.which("hadd") is None:
+        raise RuntimeError("hadd not found, can't merge the shard outputs")
+    subprocess.check_call(["hadd", "-f", target] + outputs)
+
+
+if __name__=="__main__":
+    parser = argparse.ArgumentParser(description="run simpleAnalysis over many DAODs in parallel shards")
+    parser.add_argument("inputs", nargs="+", help="DAOD files, globs, comma joined lists or @filelist")
+    parser.add_argument("-a", "--analysis", default="VBS")
+    parser.add_argument("-j", "--jobs", type=int, default=os.cpu_count(), help="concurrent simpleAnalysis processes")
+    parser.add_argument("-s", "--shards", type=int, help="number of shards (default: one per job)")
+    parser.add_argument("-r", "--retries", type=int, default=2, help="retries per failed shard")
+    parser.add_argument("-w", "--workdir", default="shards")
+    parser.add_argument("-o", "--output", default="VBS.root")
+    parser.add_argument("--hadd", action="store_true", help="merge with hadd instead of hmerge.py")
+    parser.add_argument("--allow-partial", action="store_true", help="merge even if some shards failed")
+    parser.add_argument("--sa-args", default="", help="extra simpleAnalysis options, e.g. --sa-args=-n")
+    args = parser.parse_args()
+
+    extra = shlex.split(args.sa_args)
+    files = expand(args.inputs)
+    if not files:
+        parser.error("no input files")
+    shards = [shard(i, fs, args.workdir) for i, fs in enumerate(make_shards(files, args.shards or args.jobs))]
+    print("{} files in {} shards, {} at a time".format(len(files), len(shards), args.jobs))
+
+    failed = run_shards(shards, args.jobs, args.retries, args.analysis, extra)
+    for s in failed:
+        print("shard {:03d} gave up after {} attempts, see {}".format(s.index, s.attempts, s.dir))
+    if failed and not args.allow_partial:
+        sys.exit(1)
+
+    outputs = [s.output(args.analysis) for s in shards if s.status == "done"]
+    print("Merging {} shard outputs into {}".format(len(outputs), args.output))
+    merge(outputs, args.output, args.hadd)
+    print("Done")
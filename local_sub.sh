@@ -1,3 +1,5 @@
 #!/bin/bash
-simpleAnalysis -a VBS /uclhc-2/data/uclhc/uci/user/ucigroup/VBS_H_MCsamples/submitDir_2022-06-01_MCTruth3_VBS_WpmWpmHjj_e8307_p4189_v01/output_0/DAOD_TRUTH3.VBS_WpmWpmHjj_0.pool.root,/uclhc-2/data/uclhc/uci/user/ucigroup/VBS_H_MCsamples/submitDir_2022-06-01_MCTruth3_VBS_WpmWpmHjj_e8307_p4189_v01/output_1/DAOD_TRUTH3.VBS_WpmWpmHjj_1.pool.root
+# runs simpleAnalysis in parallel shards (one per core) and merges everything into VBS.root
+# extra options go to local_driver.py, e.g. ./local_sub.sh -j 32 --retries 3
+python "$(dirname "$0")/local_driver.py" -a VBS "$@" /uclhc-2/data/uclhc/uci/user/ucigroup/VBS_H_MCsamples/submitDir_2022-06-01_MCTruth3_VBS_WpmWpmHjj_e8307_p4189_v01/output_0/DAOD_TRUTH3.VBS_WpmWpmHjj_0.pool.root,/uclhc-2/data/uclhc/uci/user/ucigroup/VBS_H_MCsamples/submitDir_2022-06-01_MCTruth3_VBS_WpmWpmHjj_e8307_p4189_v01/output_1/DAOD_TRUTH3.VBS_WpmWpmHjj_1.pool.root
 echo Done
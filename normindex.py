@@ -0,0 +1,125 @@
+import argparse
+import concurrent.futures
+import os
+import numpy as np
+import hcache
+import histio
+import ntuple
+
+# persistent sum-of-weights index for MC normalisation
+# maps absolute path -> {"size", "mtime", "sumw", "sumw2", "events", "source", "norm"}
+# an entry is valid as long as the file's size and mtime are unchanged, so a file is
+# only ever opened again after it was rewritten
+# sumw comes from the 1-bin mc_weight histogram VBS.cxx fills, or from the mc_weight
+# ntuple branch if the file has no histograms; "norm" is the last normalisation factor
+# (expected events / sample sumw) computed for the file, see samples.py
+index_file = "sumw_index.json"
+# same versioned JSON file as the hcache indexes; bump this if what goes into an entry
+# changes, old indexes are then ignored
+version = 1
+weight_key = "mc_weight"
+
+
+def stat_key(path):
+    st = os.stat(path)
+    return st.st_size, st.st_mtime_ns
+
+
+def load_index(path=index_file):
+    return hcache.read_versioned(path, version, "files")
+
+
+def save_index(files, path=index_file):
+    hcache.write_versioned(path, version, "files", files)
+
+
+def valid(files, path):
+    e = files.get(os.path.abspath(path))
+    if e is None:
+        return False
+    size, mtime = stat_key(path)
+    return e["size"] == size and e["mtime"] == mtime
+
+
+def scan(path):
+    # one file -> index entry, only the mc_weight histogram (or branch) is read
+    size, mtime = stat_key(path)
+    e = {"size": size, "mtime": mtime}
+    with histio.open_file(path) as f:
+        if weight_key in histio.keys(f):
+            h = histio.read_hist(f, weight_key)
+            e.update(sumw=float(h.values.sum()), sumw2=float(h.sumw2.sum()),
+                     events=int(h.entries if h.entries is not None else 0), source="hist")
+            return e
+    sumw = sumw2 = 0.
+    events = 0
+    for chunk in ntuple.iterate(path, [weight_key]):
+        w = chunk[weight_key].astype(np.float64)
+        sumw += w.sum()
+        sumw2 += (w*w).sum()
+        events += len(w)
+    e.update(sumw=float(sumw), sumw2=float(sumw2), events=events, source="ntuple")
+    return e
+
+
+def update(files, paths, jobs=None):
+    # (re)scan every path that isn't in the index or changed since, in a process pool
+    # returns the paths that were scanned
+    stale = [os.path.abspath(p) for p in paths if not valid(files, p)]
+    if not stale:
+        return []
+    if len(stale) == 1:
+        entries = [scan(stale[0])]
+    else:
+        with concurrent.futures.ProcessPoolExecutor(jobs) as pool:
+            entries = list(pool.map(scan, stale))
+    for p, e in zip(stale, entries):
+        files[p] = e
+    return stale
+
+
+def sample_sumw(files, paths):
+    # (sumw, events) of a sample made of several files, all of them must be in the index
+    es = [files[os.path.abspath(p)] for p in paths]
+    return sum(e["sumw"] for e in es), sum(e["events"] for e in es)
+
+
+def set_norm(files, paths, norm, **info):
+    # record the normalisation factor used for these files (plus e.g. xsec, lumi)
+    for p in paths:
+        e = files[os.path.abspath(p)]
+        e["norm"] = norm
+        e.update(info)
+
+
+def normalise(hists, factors):
+    # scale a list of hdata by one factor each in a single vectorized step:
+    # all bin contents go into one flat array, the factors are repeated per bin
+    if not hists:
+        return []
+    sizes = np.array([len(h.values) for h in hists])
+    f = np.repeat(np.asarray(factors, dtype=np.float64), sizes)
+    values = np.concatenate([h.values for h in hists])*f
+    sumw2 = np.concatenate([h.sumw2 for h in hists])*(f*f)
+    cut = np.cumsum(sizes)[:-1]
+    out = []
+    for h, v, s in zip(hists, np.split(values, cut), np.split(sumw2, cut)):
+        out.append(histio.hdata(h.name, h.edges, v, s, title=h.title, xtitle=h.xtitle, ytitle=h.ytitle, entries=h.entries))
+    return out
+
+
+if __name__=="__main__":
+    parser = argparse.ArgumentParser(description="sum of weights per file, cached by path, size and mtime")
+    parser.add_argument("inputs", nargs="+", help="analysis outputs (globs allowed)")
+    parser.add_argument("--index", default=index_file)
+    parser.add_argument("-j", "--jobs", type=int)
+    args = parser.parse_args()
+
+    paths = ntuple.expand(args.inputs)
+    files = load_index(args.index)
+    scanned = update(files, paths, args.jobs)
+    save_index(files, args.index)
+    for p in paths:
+        e = files[os.path.abspath(p)]
+        print("{:<60} {:>16.6g} {:>10d} {:>12} {}".format(p, e["sumw"], e["events"], "{:.6g}".format(e["norm"]) if "norm" in e else "-", e["source"]))
+    print("{} files, {} scanned, index in {}".format(len(paths), len(scanned), args.index))
@@ -0,0 +1,63 @@
+import glob
+import uproot
+
+# chunked reader for the per-event ntupVar branches VBS.cxx writes
+# only the requested branches are read and at most step_size entries (or bytes,
+# e.g. "100 MB") are held at a time, each chunk is a dict branch -> numpy array
+
+tree_name = "ntuple"
+
+
+def expand(paths):
+    # a path, a glob or a list of either
+    if isinstance(paths, str):
+        paths = [paths]
+    out = []
+    for p in paths:
+        matches = sorted(glob.glob(p))
+        out += matches if matches else [p]
+    return out
+
+
+def find_tree(f, tree=None):
+    # the SimpleAnalysis ntuple, or the first TTree if it has another name
+    if tree is not None:
+        return tree
+    classes = f.classnames(recursive=True, cycle=False)
+    if classes.get(tree_name) == "TTree":
+        return tree_name
+    for name, classname in classes.items():
+        if classname == "TTree":
+            return name
+    raise KeyError("no TTree in {}".format(f.file_path))
+
+
+def branches(path, tree=None):
+    with uproot.open(path) as f:
+        return list(f[find_tree(f, tree)].keys())
+
+
+def num_entries(paths, tree=None):
+    n = 0
+    for p in expand(paths):
+        with uproot.open(p) as f:
+            n += f[find_tree(f, tree)].num_entries
+    return n
+
+
+def iterate(paths, branches, step_size=100000, tree=None, cut=None, decompression_executor=None, library="np"):
+    # yields {branch: array} chunks over all files in order
+    # branches can be names or globs ("truth_id*"), cut is an optional uproot
+    # expression applied per chunk (e.g. "jets_n >= 4")
+    # library="ak" gives awkward arrays, jagged (std::vector) branches stay jagged
+    # instead of becoming numpy arrays of arrays
+    if isinstance(branches, str):
+        branches = [branches]
+    plain = [b for b in branches if not any(c in b for c in "*?[")]
+    globs = [b for b in branches if b not in plain]
+    for p in expand(paths):
+        with uproot.open(p, decompression_executor=decompression_executor) as f:
+            t = f[find_tree(f, tree)]
+            names = plain + [k for k in t.keys(filter_name=globs) if k not in plain] if globs else plain
+            for chunk in t.iterate(names, step_size=step_size, cut=cut, library=library):
+                yield chunk
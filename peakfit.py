@@ -0,0 +1,229 @@
+import argparse
+import concurrent.futures
+import csv
+import json
+import numpy as np
+import histio
+import keyfilter
+
+# batch peak fits for the resonance histograms (m_bb, Z_mass, ...), instead of the
+# max-bin "peak" of hist.pdata or one ROOT Fit per histogram
+# histograms with the same binning and fit window are stacked into one (nhist, nbins)
+# array and fitted together: a Levenberg-Marquardt loop where every step solves the
+# normal equations of all histograms at once (batched np.linalg.solve)
+# models: a Gaussian or a Crystal Ball (power-law tail on the low side) on top of a
+# polynomial background; chunks of histograms can go to a process pool (-j)
+
+# fit windows per variable, keeping the -999 sentinel fills (underflow) and the
+# Z_mass = 0 events of the no-Z case out of the fit
+windows = {
+    "m_bb": (50., 250.),
+    "m_non_bb": (30., 150.),
+    "Z_mass": (60., 120.),
+}
+
+columns = ["file", "name", "model", "mean", "mean_err", "width", "width_err", "amplitude", "chi2", "ndf", "converged", "max_bin"]
+
+
+def poly(x, c):
+    # c: (nhist, deg+1) -> (nhist, nbins), x scaled to [-1, 1] by the caller
+    out = np.zeros((c.shape[0], len(x)))
+    for k in range(c.shape[1]):
+        out += c[:, k:k+1]*x[None, :]**k
+    return out
+
+
+def gauss(x, p, deg):
+    # p: amplitude, mean, width, background coefficients
+    a, mu, s = p[:, 0:1], p[:, 1:2], np.abs(p[:, 2:3]) + 1e-12
+    return a*np.exp(-0.5*((x[None, :] - mu)/s)**2)
+
+
+def crystal_ball(x, p, deg):
+    # p: amplitude, mean, width, alpha, n, background coefficients
+    a, mu, s = p[:, 0:1], p[:, 1:2], np.abs(p[:, 2:3]) + 1e-12
+    alpha = np.abs(p[:, 3:4]) + 1e-3
+    n = np.abs(p[:, 4:5]) + 1.001
+    t = (x[None, :] - mu)/s
+    core = np.exp(-0.5*t*t)
+    b = n/alpha - alpha
+    # only used where t <= -alpha, i.e. b - t >= n/alpha; elsewhere clipped to stay finite
+    tail = np.exp(n*(np.log(n/alpha) - np.log(np.maximum(b - t, n/alpha))) - 0.5*alpha*alpha)
+    return a*np.where(t > -alpha, core, tail)
+
+
+models = {"gauss": (gauss, 3), "cb": (crystal_ball, 5)}
+
+
+def evaluate(model, x, p, deg, lo, hi):
+    shape, npeak = models[model]
+    u = 2*(x - lo)/(hi - lo) - 1
+    return shape(x, p, deg) + poly(u, p[:, npeak:])
+
+
+def jacobian(model, x, p, deg, lo, hi, f0):
+    # forward differences, one model evaluation per parameter for all histograms
+    J = np.empty((p.shape[0], len(x), p.shape[1]))
+    for k in range(p.shape[1]):
+        h = 1e-6*np.maximum(np.abs(p[:, k]), 1e-3)
+        q = p.copy()
+        q[:, k] += h
+        J[:, :, k] = (evaluate(model, x, q, deg, lo, hi) - f0)/h[:, None]
+    return J
+
+
+def initial(model, x, y, deg):
+    # peak height and position from the largest bin above a flat background guess,
+    # width from the half maximum crossing
+    nh = y.shape[0]
+    bkg = np.median(np.concatenate([y[:, :3], y[:, -3:]], axis=1), axis=1)
+    sig = y - bkg[:, None]
+    i = np.argmax(sig, axis=1)
+    amp = sig[np.arange(nh), i]
+    above = sig >= 0.5*amp[:, None]
+    width = np.maximum(above.sum(axis=1), 1)*(x[1] - x[0])/2.355
+    p = [amp, x[i], width]
+    if model == "cb":
+        p += [np.full(nh, 1.5), np.full(nh, 3.)]
+    p += [bkg] + [np.zeros(nh)]*deg
+    return np.column_stack(p)
+
+
+def fit_stack(model, x, y, var, deg=1, lo=None, hi=None, iterations=200, tol=1e-7):
+    # y, var: (nhist, nbins) contents and variances inside the window at bin centers x
+    # returns (params, covariances, chi2, converged); a fit stops when the chi2 step gets
+    # below tol or when no damped step improves it any more, not converged = out of iterations
+    lo = x[0] if lo is None else lo
+    hi = x[-1] if hi is None else hi
+    w = 1/np.where(var > 0, var, np.maximum(var.max(axis=1, keepdims=True), 1))
+    p = initial(model, x, y, deg)
+    nh, npar = p.shape
+    lam = np.full(nh, 1e-3)
+    f = evaluate(model, x, p, deg, lo, hi)
+    chi2 = (w*(y - f)**2).sum(axis=1)
+    converged = np.zeros(nh, dtype=bool)
+    eye = np.eye(npar)
+    for it in range(iterations):
+        J = jacobian(model, x, p, deg, lo, hi, f)
+        A = np.einsum("hbi,hb,hbj->hij", J, w, J)
+        g = np.einsum("hbi,hb->hi", J, w*(y - f))
+        damp = A + lam[:, None, None]*A*eye
+        try:
+            dp = np.linalg.solve(damp, g[:, :, None])[:, :, 0]
+        except np.linalg.LinAlgError:
+            dp = (np.linalg.pinv(damp) @ g[:, :, None])[:, :, 0]
+        dp[converged] = 0
+        q = p + dp
+        fq = evaluate(model, x, q, deg, lo, hi)
+        cq = (w*(y - fq)**2).sum(axis=1)
+        better = np.isfinite(cq) & (cq <= chi2)
+        step = np.where(better, chi2 - cq, 0)
+        p = np.where(better[:, None], q, p)
+        f = np.where(better[:, None], fq, f)
+        converged |= better & (step <= np.maximum(tol*chi2, 1e-4))
+        chi2 = np.where(better, cq, chi2)
+        lam = np.where(better, lam/10, lam*10)
+        converged |= lam > 1e12
+        if converged.all():
+            break
+    J = jacobian(model, x, p, deg, lo, hi, f)
+    A = np.einsum("hbi,hb,hbj->hij", J, w, J)
+    cov = np.linalg.pinv(A)
+    return p, cov, chi2, converged
+
+
+def window_of(name, edges):
+    return windows.get(name.rpartition("/")[2], (edges[0], edges[-1]))
+
+
+def fit_group(task):
+    # one stack of histograms with the same binning and window; runs in the pool too
+    model, deg, names, edges, values, sumw2, (lo, hi) = task
+    centers = 0.5*(edges[1:] + edges[:-1])
+    sel = (centers >= lo) & (centers <= hi)
+    x = centers[sel]
+    y = values[:, 1:-1][:, sel]
+    var = sumw2[:, 1:-1][:, sel]
+    p, cov, chi2, ok = fit_stack(model, x, y, var, deg, lo, hi)
+    rows = []
+    ndf = len(x) - p.shape[1]
+    for i, name in enumerate(names):
+        inner = values[i, 1:-1]
+        rows.append({"name": name, "model": model, "mean": p[i, 1], "mean_err": np.sqrt(max(cov[i, 1, 1], 0)),
+                     "width": abs(p[i, 2]), "width_err": np.sqrt(max(cov[i, 2, 2], 0)), "amplitude": p[i, 0],
+                     "chi2": chi2[i], "ndf": ndf, "converged": bool(ok[i]),
+                     "max_bin": float(centers[np.argmax(inner)])})
+    return rows
+
+
+def fit(hists, model="gauss", deg=1, jobs=None, chunk=256, files=None):
+    # hists: histio.hdata; returns one row dict per histogram, in input order
+    # files: label of the input file of every histogram, for the "file" column; the
+    # names stay the plain keys, so the fit window is found from "m_bb" or "loose/m_bb"
+    groups = {}
+    for i, h in enumerate(hists):
+        win = window_of(h.name, h.edges)
+        groups.setdefault((h.edges.tobytes(), win), []).append(i)
+    tasks = []
+    order = []
+    for (eb, win), g in groups.items():
+        for k in range(0, len(g), chunk):
+            part = [hists[i] for i in g[k:k+chunk]]
+            order.append(g[k:k+chunk])
+            tasks.append((model, deg, [h.name for h in part], part[0].edges,
+                          np.stack([h.values for h in part]), np.stack([h.sumw2 for h in part]), win))
+    if jobs and jobs > 1 and len(tasks) > 1:
+        with concurrent.futures.ProcessPoolExecutor(jobs) as pool:
+            results = list(pool.map(fit_group, tasks))
+    else:
+        results = [fit_group(t) for t in tasks]
+    out = [None]*len(hists)
+    for idx, rows in zip(order, results):
+        for i, r in zip(idx, rows):
+            r["file"] = files[i] if files is not None else ""
+            out[i] = r
+    return out
+
+
+def write_table(rows, path):
+    if path.endswith(".json"):
+        with open(path, "w") as fout:
+            json.dump([{c: (float(r[c]) if isinstance(r[c], (np.floating, float)) else r[c]) for c in columns} for r in rows], fout, indent=1)
+        return
+    with open(path, "w", newline="") as fout:
+        w = csv.writer(fout)
+        w.writerow(columns)
+        for r in rows:
+            w.writerow([r[c] for c in columns])
+
+
+if __name__=="__main__":
+    parser = argparse.ArgumentParser(description="batch peak fits of mass histograms")
+    parser.add_argument("inputs", nargs="+", help="ROOT files with the histograms")
+    parser.add_argument("--include", action="append", default=[], help="keys to fit (glob or re:regex), default the ones with a fit window: " + ", ".join(windows))
+    parser.add_argument("--exclude", action="append", default=[])
+    parser.add_argument("-m", "--model", choices=sorted(models), default="gauss")
+    parser.add_argument("--deg", type=int, default=1, help="degree of the background polynomial")
+    parser.add_argument("--window", action="append", default=[], help="fit window, name=lo,hi")
+    parser.add_argument("-j", "--jobs", type=int, help="worker processes for the fit chunks")
+    parser.add_argument("-o", "--output", default="peaks.csv", help=".csv or .json")
+    args = parser.parse_args()
+
+    for wdef in args.window:
+        name, rng = wdef.split("=", 1)
+        windows[name] = tuple(float(v) for v in rng.split(","))
+    filt = keyfilter.keyfilter(args.include or list(windows), args.exclude)
+    hists = []
+    files = []
+    for path in args.inputs:
+        with histio.open_file(path) as f:
+            for h in histio.iter_hists(f, histio.keys(f, filt)):
+                hists.append(h)
+                files.append(path)
+    rows = fit(hists, args.model, args.deg, args.jobs, files=files)
+    write_table(rows, args.output)
+    for r in rows:
+        label = "{}:{}".format(r["file"], r["name"]) if len(args.inputs) > 1 else r["name"]
+        print("{:<40} mean {:9.3f} +- {:7.3f}  width {:8.3f} +- {:7.3f}  chi2/ndf {:8.1f}/{:<3d} {}".format(
+            label, r["mean"], r["mean_err"], r["width"], r["width_err"], r["chi2"], r["ndf"], "" if r["converged"] else "NOT CONVERGED"))
+    print("{} fits written to {}".format(len(rows), args.output))
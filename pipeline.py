@@ -0,0 +1,148 @@
+import concurrent.futures
+import os
+import queue
+import threading
+import time
+
+# read-ahead / write-behind around the uhist.py key loop, so NFS latency overlaps
+# with drawing instead of adding to it
+# prefetcher: a bounded thread pool reads the raw bytes of the next `depth` keys
+# (their TKey records, seek + nbytes) with pread while the current key is drawn;
+# the bytes are dropped again, they only have to land in the page cache so the
+# following f.Get is served from memory. At most depth reads are in flight.
+# writer: one thread owns the output file and writes the queued objects in
+# batches, the loop only hands objects over. The queue is bounded too, a slow
+# disk makes the loop wait instead of piling up canvases. With timed=True the
+# writer keeps the wall time of every tagged write, the loop itself only sees
+# how long the hand-over took.
+
+
+class prefetcher:
+
+    def __init__(self, path, ranges, depth=16, threads=4, block=1 << 20):
+        # ranges: [(name, seek, nbytes)] in the order the keys will be asked for
+        self.fd = os.open(path, os.O_RDONLY)
+        self.ranges = ranges
+        self.pos = {name: i for i, (name, seek, nbytes) in enumerate(ranges)}
+        self.depth = depth
+        self.block = block
+        self.pool = concurrent.futures.ThreadPoolExecutor(threads)
+        self.futures = {}
+        self.submitted = 0
+        self.bytes = 0
+        self.ahead(0)
+
+
+    def read(self, seek, nbytes):
+        # pread drops the GIL, so these run while the main thread draws
+        done = 0
+        while done < nbytes:
+            data = os.pread(self.fd, min(self.block, nbytes - done), seek + done)
+            if not data:
+                break
+            done += len(data)
+        return done
+
+
+    def ahead(self, i):
+        while self.submitted < len(self.ranges) and self.submitted < i + self.depth:
+            name, seek, nbytes = self.ranges[self.submitted]
+            self.futures[name] = self.pool.submit(self.read, seek, nbytes)
+            self.submitted += 1
+
+
+    def wait(self, name):
+        # block until name's bytes are in, then queue the next read
+        i = self.pos.get(name)
+        if i is None:
+            return
+        self.ahead(i + 1)
+        fut = self.futures.pop(name, None)
+        if fut is not None:
+            self.bytes += fut.result()
+
+
+    def close(self):
+        self.pool.shutdown(wait=True, cancel_futures=True)
+        os.close(self.fd)
+
+
+def root_ranges(f, names):
+    # [(name, seek, nbytes)] from the TKeys of a PyROOT file, nested names included;
+    # only the key headers already in memory are looked at
+    out = []
+    for name in names:
+        path, _, base = name.rpartition("/")
+        d = f.GetDirectory(path) if path else f
+        key = d.GetKey(base) if d else None
+        if key:
+            out.append((name, key.GetSeekKey(), key.GetNbytes()))
+    return out
+
+
+class writer(threading.Thread):
+
+    def __init__(self, outp, place, batch=32, depth=256, release=None, timed=False):
+        # place(outp, path) -> (directory, name), e.g. uhist.out_dir
+        # release(*objs): called for drop()ped objects once everything queued before is written
+        # timed: keep (tag, seconds) of every write put() with a tag in self.timings
+        threading.Thread.__init__(self, daemon=True)
+        self.outp = outp
+        self.place = place
+        self.batch = batch
+        self.release = release
+        self.queue = queue.Queue(depth)
+        self.timed = timed
+        self.timings = []
+        self.error = None
+        self.written = 0
+        self.start()
+
+
+    def put(self, path, obj, tag=None):
+        if self.error is not None:
+            raise self.error
+        self.queue.put((path, obj, tag))
+
+
+    def drop(self, *objs):
+        # objects to let go of after their writes (uhist.py --stream)
+        self.queue.put((None, objs, None))
+
+
+    def run(self):
+        stop = False
+        while not stop:
+            items = [self.queue.get()]
+            while len(items) < self.batch:
+                try:
+                    items.append(self.queue.get_nowait())
+                except queue.Empty:
+                    break
+            for item in items:
+                if item is None:
+                    stop = True
+                    continue
+                if self.error is not None:
+                    continue
+                path, obj, tag = item
+                try:
+                    if path is None:
+                        if self.release is not None:
+                            self.release(*obj)
+                        continue
+                    t0 = time.perf_counter()
+                    d, name = self.place(self.outp, path)
+                    d.WriteTObject(obj, name)
+                    if self.timed and tag is not None:
+                        self.timings.append((tag, time.perf_counter() - t0))
+                    self.written += 1
+                except Exception as e:
+                    self.error = e
+
+
+    def close(self):
+        self.queue.put(None)
+        self.join()
+        if self.error is not None:
+            raise self.error
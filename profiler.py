@@ -0,0 +1,144 @@
+import contextlib
+import json
+import os
+import resource
+import time
+
+# per-stage, per-key timing and I/O accounting for the uhist.py loop (--profile)
+# wall time from perf_counter, bytes read/written from /proc/self/io (rchar/wchar, so
+# NFS traffic counts too), RSS from /proc/self/statm; two small /proc reads per stage
+# keep the overhead in the microseconds, cheap next to a TCanvas draw
+# where /proc isn't there (macOS) the byte counters stay 0 and RSS is the peak RSS
+
+page = os.sysconf("SC_PAGE_SIZE") if hasattr(os, "sysconf") else 4096
+
+
+class procstat:
+
+    def __init__(self):
+        try:
+            self.io = open("/proc/self/io", "rb", buffering=0)
+        except OSError:
+            self.io = None
+        try:
+            self.statm = open("/proc/self/statm", "rb", buffering=0)
+        except OSError:
+            self.statm = None
+        # rchar also counts our own /proc reads, they are taken out again
+        self.own = 0
+
+
+    def read(self):
+        # (bytes read, bytes written, rss bytes)
+        rchar = wchar = 0
+        if self.io is not None:
+            self.io.seek(0)
+            data = self.io.read()
+            self.own += len(data)
+            for line in data.split(b"\n"):
+                if line.startswith(b"rchar:"):
+                    rchar = int(line.split()[1])
+                elif line.startswith(b"wchar:"):
+                    wchar = int(line.split()[1])
+        if self.statm is not None:
+            self.statm.seek(0)
+            data = self.statm.read()
+            self.own += len(data)
+            rss = int(data.split()[1])*page
+        else:
+            rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss*1024
+        return rchar - self.own, wchar, rss
+
+
+class profiler:
+
+    def __init__(self):
+        self.proc = procstat()
+        self.keys = {}
+        self.order = []
+        self.start = time.perf_counter()
+
+
+    @contextlib.contextmanager
+    def stage(self, name, key):
+        r0, w0, _ = self.proc.read()
+        t0 = time.perf_counter()
+        try:
+            yield
+        finally:
+            t1 = time.perf_counter()
+            r1, w1, rss = self.proc.read()
+            if key not in self.keys:
+                self.keys[key] = {}
+                self.order.append(key)
+            st = self.keys[key].setdefault(name, {"wall": 0., "read": 0, "written": 0, "rss": 0})
+            st["wall"] += t1 - t0
+            st["read"] += r1 - r0
+            st["written"] += w1 - w0
+            st["rss"] = rss
+
+
+    def add(self, name, key, wall):
+        # a stage timed elsewhere (the --write-batch writer thread): wall time only, the
+        # /proc byte counters are per process and can't be split between the threads
+        if key not in self.keys:
+            self.keys[key] = {}
+            self.order.append(key)
+        st = self.keys[key].setdefault(name, {"wall": 0., "read": 0, "written": 0, "rss": 0})
+        st["wall"] += wall
+
+
+    def merge(self, other):
+        # other: a report dict from a --jobs worker, keys are appended in its order
+        for key in other["order"]:
+            self.keys[key] = other["keys"][key]
+            self.order.append(key)
+
+
+    def totals(self):
+        out = {}
+        for key in self.order:
+            for name, st in self.keys[key].items():
+                t = out.setdefault(name, {"wall": 0., "read": 0, "written": 0, "calls": 0})
+                t["wall"] += st["wall"]
+                t["read"] += st["read"]
+                t["written"] += st["written"]
+                t["calls"] += 1
+        return out
+
+
+    def slowest(self, n=10):
+        wall = [(sum(st["wall"] for st in self.keys[k].values()), k) for k in self.order]
+        return sorted(wall, reverse=True)[:n]
+
+
+    def report(self, top=10):
+        rss = [st["rss"] for k in self.order for st in self.keys[k].values()]
+        return {"wall": time.perf_counter() - self.start,
+                "peak_rss": max(rss) if rss else 0,
+                "stages": self.totals(),
+                "top": [{"key": k, "wall": w} for w, k in self.slowest(top)],
+                "order": self.order,
+                "keys": self.keys}
+
+
+    def write(self, path, top=10):
+        with open(path, "w") as fout:
+            json.dump(self.report(top), fout, indent=1)
+
+
+    def summary(self, top=10):
+        lines = ["stage            wall [s]    read [MB]  written [MB]"]
+        for name, t in sorted(self.totals().items(), key=lambda x: -x[1]["wall"]):
+            lines.append("{:<14} {:>10.3f} {:>12.2f} {:>13.2f}".format(name, t["wall"], t["read"]/1e6, t["written"]/1e6))
+        lines.append("slowest keys:")
+        for w, k in self.slowest(top):
+            lines.append("  {:<30} {:.3f}s".format(k, w))
+        return "\n".join(lines)
+
+
+class null:
+    # stand in when --profile is off
+
+    def stage(self, name, key):
+        return contextlib.nullcontext()
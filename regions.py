@@ -0,0 +1,196 @@
+import argparse
+import csv
+import re
+import numpy as np
+import histio
+import ntuple
+import rehist
+
+# columnar region/cutflow engine over the VBS ntuple
+# a cut is a named expression on the ntuple branches ("jets_n >= 4") or a function
+# chunk -> mask, a region is an ordered list of cut names that all have to pass
+# every distinct cut (and every shared prefix of cuts) is evaluated once per chunk and
+# the mask reused by all regions, so any number of regions costs one read of the data
+
+# the selections from VBS.cxx as cuts; the bad jet veto and the jets_n < 4 return happen
+# before anything is written to the ntuple, so they are already applied here
+vbs_cuts = {
+    "4j": "jets_n >= 4",
+    "2b": "bjets_n >= 2",
+    "met200": "met > 200",
+    "met250": "met > 250",
+    "dphi04": "dphi_min > 0.4",
+    "meff700": "meff_4j > 700",
+    "meff900": "meff_4j > 900",
+    "0l": "baseline_leptons_n == 0",
+    "exactly2b_le5j": "(bjets_n == 2) & (jets_n <= 5)",
+    "exactly4j": "jets_n == 4",
+    "mbb_window": "(m_bb > 105) & (m_bb < 135)",
+    "mqq_window": "(m_non_bb > 75) & (m_non_bb < 90)",
+    "SR1_tail": "(mTb_min > 140) & (mCT_bb > 140)",
+    "SR2_tail": "(mTb_min > 160) & (mCT_bb > 140)",
+    "SR3_tail": "(mTb_min > 180) & (mCT_bb > 190)",
+    "Z_2l": "(signal_electrons_n == 2) | (signal_muons_n == 2)",
+    "Z_leptons": "(pt_lep_1 > 140) & (pt_lep_2 > 20)",
+    "Z_mass": "(Z_mass > 75) & (Z_mass < 105)",
+    "mbb200": "m_bb > 200",
+}
+
+medium = ["4j", "2b", "met200", "dphi04", "meff700"]
+vbs_regions = {
+    "loose": [],
+    "medium": medium,
+    "tight": medium + ["exactly2b_le5j"],
+    "medium_0l": medium + ["0l"],
+    "tight_0l": medium + ["0l", "exactly2b_le5j"],
+    "SR1": medium + ["0l", "exactly2b_le5j", "mbb_window", "mqq_window", "exactly4j", "meff900", "SR1_tail"],
+    "SR2": medium + ["0l", "exactly2b_le5j", "mbb_window", "mqq_window", "meff900", "met250", "SR2_tail"],
+    "SR3": medium + ["0l", "exactly2b_le5j", "mbb_window", "mqq_window", "SR3_tail"],
+    "CR1Z": medium + ["Z_2l", "Z_leptons", "exactly2b_le5j", "mbb200", "Z_mass", "meff900"],
+    "CR2Z": medium + ["Z_2l", "Z_leptons", "exactly2b_le5j", "mbb200", "Z_mass", "meff900", "met250"],
+    "CR3Z": medium + ["Z_2l", "Z_leptons", "exactly2b_le5j", "mbb200", "Z_mass"],
+}
+
+
+def branches_of(expr):
+    return set(re.findall(r"[A-Za-z_]\w*", expr)) - {"abs", "np", "and", "or", "not"}
+
+
+class masks:
+    # lazy per-chunk cache: cut name -> mask, tuple of cut names -> combined mask
+
+    def __init__(self, chunk, cuts):
+        self.chunk = chunk
+        self.cuts = cuts
+        self.n = len(chunk[next(iter(chunk))])
+        self.cache = {(): np.ones(self.n, dtype=bool)}
+        self.evaluated = 0
+
+
+    def cut(self, name):
+        key = (name,)
+        if key not in self.cache:
+            c = self.cuts[name]
+            if callable(c):
+                m = c(self.chunk)
+            else:
+                m = eval(c, {"np": np, "abs": np.abs}, self.chunk)
+            self.cache[key] = np.broadcast_to(np.asarray(m, dtype=bool), (self.n,))
+            self.evaluated += 1
+        return self.cache[key]
+
+
+    def prefix(self, names):
+        # mask of the first len(names) cuts of a region, built on the shorter prefix
+        names = tuple(names)
+        if names not in self.cache:
+            self.cache[names] = self.prefix(names[:-1]) & self.cut(names[-1])
+        return self.cache[names]
+
+
+class selection:
+
+    def __init__(self, cuts=None, regions=None):
+        self.cuts = dict(vbs_cuts if cuts is None else cuts)
+        self.regions = dict(vbs_regions if regions is None else regions)
+
+
+    def add_cut(self, name, expr):
+        self.cuts[name] = expr
+
+
+    def add_region(self, name, cuts):
+        missing = [c for c in cuts if c not in self.cuts]
+        if missing:
+            raise KeyError("region {} uses unknown cuts {}".format(name, missing))
+        self.regions[name] = list(cuts)
+
+
+    def needed(self):
+        out = set()
+        for names in self.regions.values():
+            for c in names:
+                if not callable(self.cuts[c]):
+                    out |= branches_of(self.cuts[c])
+        return out
+
+
+    def run(self, paths, specs=None, weight=None, step_size=100000, tree=None, branches=()):
+        # returns (cutflow, hists)
+        # cutflow: region -> list of [cut, events, sumw, sumw2] after each cut ("all" first)
+        # hists: region -> list of histio.hdata filled with the events passing the region
+        paths = ntuple.expand(paths)
+        have = set(ntuple.branches(paths[0], tree))
+        if specs is None:
+            specs = {}
+        edges = {k: rehist.edges_of(v) for k, v in specs.items()}
+        read = (self.needed() | set(edges) | set(branches) | ({weight} if weight else set())) & have
+        flows = {r: np.zeros((len(c) + 1, 3)) for r, c in self.regions.items()}
+        parts = {r: rehist.partial(edges) for r in self.regions}
+        self.evaluated = 0
+        for chunk in ntuple.iterate(paths, sorted(read), step_size=step_size, tree=tree):
+            m = masks(chunk, self.cuts)
+            w = np.ones(m.n) if weight is None else np.asarray(chunk[weight], dtype=np.float64)
+            for r, names in self.regions.items():
+                for k in range(len(names) + 1):
+                    sel = m.prefix(names[:k])
+                    ws = w[sel]
+                    flows[r][k] += (len(ws), ws.sum(), (ws*ws).sum())
+                sel = m.prefix(names)
+                for name in edges:
+                    parts[r].fill(name, chunk[name][sel], None if weight is None else w[sel])
+            self.evaluated += m.evaluated
+        cutflow = {r: [[c] + list(row) for c, row in zip(["all"] + names, flows[r])] for r, names in self.regions.items()}
+        hists = {}
+        for r in self.regions:
+            hists[r] = rehist.reduce([parts[r]], edges)
+            for h in hists[r]:
+                h.name = "{}/{}".format(r, h.name)
+        return cutflow, hists
+
+
+def write_cutflow(cutflow, path):
+    with open(path, "w", newline="") as fout:
+        w = csv.writer(fout)
+        w.writerow(["region", "step", "cut", "events", "sumw", "sumw2"])
+        for r, rows in cutflow.items():
+            for k, row in enumerate(rows):
+                w.writerow([r, k, row[0], int(row[1]), row[2], row[3]])
+
+
+def print_cutflow(cutflow):
+    for r, rows in cutflow.items():
+        print(r)
+        for row in rows:
+            print("  {:<16} {:>10d} {:>14.4f}".format(row[0], int(row[1]), row[2]))
+
+
+if __name__=="__main__":
+    parser = argparse.ArgumentParser(description="cutflows and per-region histograms from the VBS ntuple in one pass")
+    parser.add_argument("inputs", nargs="+", help="analysis outputs with the ntuple (globs allowed)")
+    parser.add_argument("-r", "--region", action="append", default=[], help="only these of the built in regions")
+    parser.add_argument("--cut", action="append", default=[], help="extra cut, name=expression")
+    parser.add_argument("--define", action="append", default=[], help="extra region, name=cut1,cut2,...")
+    parser.add_argument("-H", "--hist", action="append", default=[], help="histograms per region, as in rehist.py")
+    parser.add_argument("-w", "--weight", help="weight branch, e.g. mc_weight")
+    parser.add_argument("--step", type=int, default=100000)
+    parser.add_argument("--cutflow", default="cutflow.csv")
+    parser.add_argument("-o", "--output", default="regions.root", help="per-region histograms, one directory per region")
+    args = parser.parse_args()
+
+    sel = selection()
+    for c in args.cut:
+        name, expr = c.split("=", 1)
+        sel.add_cut(name, expr)
+    if args.region:
+        sel.regions = {r: sel.regions[r] for r in args.region}
+    for d in args.define:
+        name, cuts = d.split("=", 1)
+        sel.add_region(name, [c for c in cuts.split(",") if c])
+    specs = dict(rehist.parse_spec(h) for h in args.hist)
+    cutflow, hists = sel.run(args.inputs, specs, args.weight, args.step)
+    print_cutflow(cutflow)
+    write_cutflow(cutflow, args.cutflow)
+    if specs:
+        histio.write_hists(args.output, [h for r in hists for h in hists[r]])
+    print("{} regions, {} distinct cut evaluations, cutflow in {}".format(len(sel.regions), sel.evaluated, args.cutflow))
@@ -0,0 +1,271 @@
+import argparse
+import concurrent.futures
+import fnmatch
+import os
+import threading
+import numpy as np
+import features
+import histio
+import ntuple
+import syst
+from uhist import xname
+
+# re-histogramming straight from the ntupVar branches, no simpleAnalysis rerun needed
+# chunks from ntuple.iterate are filled in a thread pool, every thread keeps its own
+# partial histograms and the partials are summed once at the end
+# weight variations (e.g. the mc_weights vector) are filled alongside, all of them in
+# one bincount per variable into a (nbins+2, nvariations) array
+
+# same binning as VBS::Init, (nbins, xmin, xmax) or an array of edges
+binning = {
+    'meff_incl' : (200, 0, 2000),
+    'meff_4j' : (200, 0, 2000),
+    'met' : (100, 0, 1000),
+    'met_phi' : (80, -4, 4),
+    'mTb_min' : (100, 0, 1000),
+    'mCT_bb' : (100, 0, 1000),
+    'dphi_min' : (40, 0, 4),
+    'dphi_1jet' : (40, 0, 4),
+    'm_bb' : (200, 0, 1000),
+    'm_non_bb' : (200, 0, 1000),
+    'ZCR_meff_4j' : (200, 0, 2000),
+    'ZCR_met' : (100, 0, 1000),
+    'Z_mass' : (200, 0, 1000),
+    'pt_lep_1' : (200, 0, 1000),
+    'pt_lep_2' : (200, 0, 1000),
+    'eta_lep_1' : (80, -4, 4),
+    'eta_lep_2' : (80, -4, 4),
+    'phi_lep_1' : (80, -4, 4),
+    'phi_lep_2' : (80, -4, 4),
+    'pt_jet_1' : (200, 0, 2000),
+    'pt_jet_2' : (200, 0, 2000),
+    'pt_jet_3' : (200, 0, 2000),
+    'pt_jet_4' : (200, 0, 2000),
+    'pt_jet_5' : (200, 0, 2000),
+    'pt_jet_6' : (200, 0, 2000),
+    'eta_jet_1' : (80, -5, 5),
+    'eta_jet_2' : (80, -5, 5),
+    'eta_jet_3' : (80, -5, 5),
+    'eta_jet_4' : (80, -5, 5),
+    'eta_jet_5' : (80, -5, 5),
+    'eta_jet_6' : (80, -5, 5),
+    'phi_jet_1' : (80, -4, 4),
+    'phi_jet_2' : (80, -4, 4),
+    'pt_bjet_1' : (200, 0, 2000),
+    'pt_bjet_2' : (200, 0, 2000),
+    'pt_bjet_3' : (200, 0, 2000),
+    'pt_bjet_4' : (200, 0, 2000),
+    'jets_n' : (20, -0.5, 19.5),
+    'bjets_n' : (20, -0.5, 19.5),
+    'signal_electrons_n' : (20, -0.5, 19.5),
+    'signal_muons_n' : (20, -0.5, 19.5),
+    'signal_taus_n' : (20, -0.5, 19.5),
+    'signal_leptons_n' : (20, -0.5, 19.5),
+    'baseline_electrons_n' : (20, -0.5, 19.5),
+    'baseline_muons_n' : (20, -0.5, 19.5),
+    'baseline_taus_n' : (20, -0.5, 19.5),
+    'baseline_leptons_n' : (20, -0.5, 19.5),
+    'gen_filt_met' : (200, 0, 2000),
+    'gen_filt_ht' : (200, 0, 2000),
+    'mc_weight' : (1, 0, 1),
+}
+binning.update(features.binnings())
+
+
+def edges_of(spec):
+    if isinstance(spec, tuple) and len(spec) == 3:
+        return np.linspace(spec[1], spec[2], int(spec[0]) + 1)
+    return np.asarray(spec, dtype=np.float64)
+
+
+def bin_index(x, edges):
+    # ROOT convention: 0 is underflow, nbins+1 is overflow (x >= xmax included), NaN goes
+    # to the overflow like TAxis::FindBin and searchsorted do
+    n = len(edges) - 1
+    if histio.uniform(edges):
+        # clipped while still float, inf and huge values would wrap around in the cast
+        pos = np.floor((x - edges[0]) * (n / (edges[-1] - edges[0])))
+        pos = np.where(np.isnan(pos), n, np.clip(pos, -1, n))
+        return pos.astype(np.int64) + 1
+    return np.searchsorted(edges, x, side="right")
+
+
+class partial:
+    # one thread's running sums for every histogram
+    # nvar > 0: also (nbins+2, nvar) sums for that many weight variations
+
+    def __init__(self, edges, nvar=0):
+        self.edges = edges
+        self.nvar = nvar
+        self.wvalues = {k: np.zeros((len(e) + 1, nvar)) for k, e in edges.items()} if nvar else {}
+        self.wsumw2 = {k: np.zeros((len(e) + 1, nvar)) for k, e in edges.items()} if nvar else {}
+        self.values = {k: np.zeros(len(e) + 1) for k, e in edges.items()}
+        self.sumw2 = {k: np.zeros(len(e) + 1) for k, e in edges.items()}
+        self.sumw = dict.fromkeys(edges, 0.)
+        self.sumwx = dict.fromkeys(edges, 0.)
+        self.entries = dict.fromkeys(edges, 0)
+
+
+    def fill(self, name, x, w=None, wvar=None):
+        # wvar: (nevents, nvar) variation weights, filled in the same pass
+        x = np.asarray(x, dtype=np.float64)
+        ok = ~np.isnan(x)
+        if not ok.all():
+            x = x[ok]
+            w = None if w is None else w[ok]
+            wvar = None if wvar is None else wvar[ok]
+        edges = self.edges[name]
+        idx = bin_index(x, edges)
+        n = len(edges) + 1
+        self.values[name] += np.bincount(idx, weights=w, minlength=n)
+        self.sumw2[name] += np.bincount(idx, weights=None if w is None else w*w, minlength=n)
+        inrange = (idx > 0) & (idx < n - 1)
+        wi = np.ones(inrange.sum()) if w is None else w[inrange]
+        self.sumw[name] += wi.sum()
+        self.sumwx[name] += (wi*x[inrange]).sum()
+        self.entries[name] += len(x)
+        if wvar is not None:
+            # bin i, variation j -> i*nvar + j, so one bincount fills the whole array
+            flat = (idx[:, None]*self.nvar + np.arange(self.nvar)).ravel()
+            size = n*self.nvar
+            self.wvalues[name] += np.bincount(flat, weights=wvar.ravel(), minlength=size).reshape(n, self.nvar)
+            self.wsumw2[name] += np.bincount(flat, weights=(wvar*wvar).ravel(), minlength=size).reshape(n, self.nvar)
+
+
+def variation_weights(chunk, variations):
+    # (nevents, nvar) from a vector branch (one array per event, e.g. mc_weights) or
+    # from several scalar branches / globs; returns (weights, labels)
+    names = [k for v in variations for k in chunk if fnmatch.fnmatchcase(k, v)]
+    if len(names) == 1 and chunk[names[0]].dtype == object:
+        w = np.stack(chunk[names[0]]).astype(np.float64) if len(chunk[names[0]]) else np.zeros((0, 0))
+        return w, ["{}_{}".format(names[0], i) for i in range(w.shape[1])]
+    return np.column_stack([np.asarray(chunk[k], dtype=np.float64) for k in names]), names
+
+
+def fill_chunk(local, parts, lock, edges, chunk, weight, cut, variations=None, labels=None):
+    if len(chunk[next(iter(chunk))]) == 0:
+        # nothing left after the cut; an empty vector branch can't tell how many
+        # variations there are either, so the chunk is skipped before looking at it
+        return 0
+    wvar = None
+    if variations:
+        wvar, names = variation_weights(chunk, variations)
+        with lock:
+            if not labels:
+                labels.extend(names)
+        if len(names) != len(labels):
+            raise ValueError("{} weight variations in this chunk, {} before".format(len(names), len(labels)))
+    p = getattr(local, "part", None)
+    if p is None:
+        p = local.part = partial(edges, 0 if wvar is None else wvar.shape[1])
+        with lock:
+            parts.append(p)
+    mask = None if cut is None else np.asarray(cut(chunk), dtype=bool)
+    if wvar is not None and mask is not None:
+        wvar = wvar[mask]
+    w = None
+    if weight is not None:
+        w = np.asarray(chunk[weight], dtype=np.float64)
+        if mask is not None:
+            w = w[mask]
+    for name in edges:
+        x = chunk[name] if mask is None else chunk[name][mask]
+        p.fill(name, x, w, wvar)
+    return len(chunk[next(iter(chunk))])
+
+
+def reduce(parts, edges, ytitle="Weighted Number of Entries"):
+    out = []
+    for name, e in edges.items():
+        h = histio.hdata(name, e, sum(p.values[name] for p in parts), sum(p.sumw2[name] for p in parts),
+                         title=name, xtitle=xname.get(name, "No X-axis title"), ytitle=ytitle,
+                         sumw=sum(p.sumw[name] for p in parts), sumwx=sum(p.sumwx[name] for p in parts),
+                         entries=sum(p.entries[name] for p in parts))
+        out.append(h)
+    return out
+
+
+def reduce_variations(parts, edges, labels, ytitle="Weighted Number of Entries"):
+    out = []
+    for name, e in edges.items():
+        out.append(syst.varhist(name, e, sum(p.wvalues[name] for p in parts), sum(p.wsumw2[name] for p in parts),
+                                labels, xtitle=xname.get(name, "No X-axis title"), ytitle=ytitle))
+    return out
+
+
+def rehist(paths, specs=None, weight=None, cut=None, threads=None, step_size=100000, tree=None, variations=None):
+    # specs: name -> binning (defaults to every VBS::Init histogram found in the ntuple)
+    # weight: branch to weight with (e.g. "mc_weight"), cut: uproot expression string or
+    # a function chunk -> boolean mask
+    # variations: weight variation branches, a vector branch ("mc_weights") or scalar
+    # branch names/globs ("weight_*")
+    # returns a list of histio.hdata, in specs order, and with variations also a
+    # list of syst.varhist: (hists, vhists)
+    paths = ntuple.expand(paths)
+    if specs is None:
+        have = set(ntuple.branches(paths[0], tree))
+        specs = {k: v for k, v in binning.items() if k in have}
+    edges = {k: edges_of(v) for k, v in specs.items()}
+    read = list(edges) + ([weight] if weight and weight not in edges else []) + list(variations or [])
+    strcut = cut if isinstance(cut, str) else None
+    fcut = None if strcut else cut
+    threads = threads or os.cpu_count()
+
+    local = threading.local()
+    parts = []
+    labels = []
+    lock = threading.Lock()
+    pending = set()
+    # at most 2 chunks per thread in flight, so memory stays bounded by the chunk size
+    with concurrent.futures.ThreadPoolExecutor(threads) as pool:
+        for chunk in ntuple.iterate(paths, read, step_size=step_size, tree=tree, cut=strcut):
+            if len(pending) >= 2*threads:
+                done, pending = concurrent.futures.wait(pending, return_when=concurrent.futures.FIRST_COMPLETED)
+                for d in done:
+                    d.result()
+            pending.add(pool.submit(fill_chunk, local, parts, lock, edges, chunk, weight, fcut, variations, labels))
+        for d in concurrent.futures.as_completed(pending):
+            d.result()
+    if not parts:
+        # nothing passed: empty histograms, a single empty variation column
+        parts = [partial(edges, 1 if variations else 0)]
+    if variations:
+        nvar = parts[0].nvar
+        return reduce(parts, edges), reduce_variations(parts, edges, labels or ["w{}".format(i) for i in range(nvar)])
+    return reduce(parts, edges)
+
+
+def parse_spec(arg):
+    # name, name:nbins,xmin,xmax or name:e0,e1,e2,e3,... (variable edges, 4 or more)
+    name, sep, rest = arg.partition(":")
+    if not sep:
+        return name, binning[name]
+    vals = [float(v) for v in rest.split(",")]
+    if len(vals) == 3:
+        return name, (int(vals[0]), vals[1], vals[2])
+    return name, np.array(vals)
+
+
+if __name__=="__main__":
+    parser = argparse.ArgumentParser(description="refill histograms from the VBS ntuple with any binning")
+    parser.add_argument("inputs", nargs="+", help="analysis outputs with the ntuple (globs allowed)")
+    parser.add_argument("-H", "--hist", action="append", default=[], help="name, name:nbins,xmin,xmax or name:e0,e1,e2,e3,...; default all VBS::Init histograms")
+    parser.add_argument("-w", "--weight", help="weight branch, e.g. mc_weight")
+    parser.add_argument("-c", "--cut", help="selection, e.g. 'jets_n >= 4'")
+    parser.add_argument("-t", "--threads", type=int)
+    parser.add_argument("--step", type=int, default=100000, help="entries per chunk")
+    parser.add_argument("-V", "--variations", action="append", default=[], help="weight variation branches: a vector branch like mc_weights, or scalar branches/globs; can be repeated")
+    parser.add_argument("--syst-output", default="rehist_syst.npz", help="bins x variations arrays, with --variations")
+    parser.add_argument("-o", "--output", default="rehist.root", help="ROOT file to feed to uhist.py -i")
+    args = parser.parse_args()
+
+    specs = dict(parse_spec(h) for h in args.hist) or None
+    hists = rehist(args.inputs, specs, args.weight, args.cut, args.threads, args.step, variations=args.variations)
+    if args.variations:
+        hists, vhists = hists
+        syst.write_npz(vhists, args.syst_output)
+        # envelopes next to the nominal histograms, name__env_down and name__env_up
+        hists += [h for vh in vhists for h in vh.envelope_hists()[1:]]
+        print("Wrote {} x {} variations to {}".format(len(vhists), vhists[0].nvar() if vhists else 0, args.syst_output))
+    histio.write_hists(args.output, hists)
+    print("Wrote {} histograms to {}".format(len(hists), args.output))
@@ -0,0 +1,163 @@
+import argparse
+import concurrent.futures
+import html
+import os
+import hcache
+import histio
+import keyfilter
+import uhist
+
+# image files of every histogram (PNG/PDF/SVG), the linear and the log canvas of
+# uhist.py drawn the same way, plus one static index.html to browse them
+# the keys are rendered by a pool of worker processes with ROOT in batch mode (no
+# display needed); the parent only reads the arrays through histio to decide what to
+# render, so it never imports ROOT: a key whose histogram, titles, draw settings and
+# formats hash the same as last time and whose files are all there is skipped
+# the render cache is an hcache index next to the output directory (<outdir>.index.json)
+
+formats = ["png", "pdf", "svg"]
+ytitle = "Weighted Number of Entries"
+
+worker = {}
+
+
+def image_base(outdir, name, log=False):
+    # "loose/m_bb" -> <outdir>/loose/m_bb, or <outdir>/loose/log_m_bb like the log canvas
+    path, _, base = name.rpartition("/")
+    if log:
+        base = uhist.draw_meta["log"]["prefix"] + base
+    return os.path.join(outdir, path, base)
+
+
+def image_files(outdir, name, fmts):
+    return [image_base(outdir, name, log) + "." + fmt for log in (False, True) for fmt in fmts]
+
+
+def content_hash(h, fmts):
+    # what the images depend on: the histogram with the titles axistitles() sets,
+    # the draw settings and the formats
+    h.xtitle = uhist.xname.get(h.name.rpartition("/")[2], "No X-axis title")
+    h.ytitle = ytitle
+    return hcache.fingerprint_hdata(h, repr((uhist.draw_meta, sorted(fmts))))
+
+
+def init_worker(input_file):
+    # once per worker process: ROOT without graphics, the input opened once
+    uhist.load_root()
+    uhist.ROOT.gROOT.SetBatch(True)
+    uhist.ROOT.gErrorIgnoreLevel = uhist.ROOT.kWarning
+    worker["file"] = uhist.ROOT.TFile(input_file)
+
+
+def render_chunk(task):
+    # worker side: draw and save both canvases of every key in the chunk
+    outdir, names, fmts = task
+    f = worker["file"]
+    done = []
+    for name in names:
+        h1 = f.Get(name)
+        h1 = uhist.hist(h1, name).axistitles()
+        os.makedirs(os.path.dirname(image_base(outdir, name)), exist_ok=True)
+        c = uhist.canvas(h1, name)
+        c_log = uhist.canvas(h1, name, log=True)
+        for canv, log in ((c, False), (c_log, True)):
+            for fmt in fmts:
+                canv.SaveAs(image_base(outdir, name, log) + "." + fmt)
+        uhist.release(c, c_log, h1)
+        done.append(name)
+    return done
+
+
+def plan(input_file, outdir, filt=None, fmts=formats, force=False):
+    # (all names, names to render, cache index with the new hashes filled in);
+    # keys no longer in the input drop out of the cache
+    cache = {} if force else hcache.load_index(outdir)
+    index = {}
+    names = []
+    todo = []
+    stale = set()
+    with histio.open_file(input_file) as f:
+        for h in histio.iter_hists(f, histio.keys(f, filt)):
+            names.append(h.name)
+            fp = content_hash(h, fmts)
+            entry = cache.get(h.name)
+            files = image_files(outdir, h.name, fmts)
+            if entry is None or entry["hash"] != fp or not all(os.path.exists(p) for p in files):
+                todo.append(h.name)
+                stale.add(h.name)
+            index[h.name] = {"hash": fp, "files": [os.path.relpath(p, outdir) for p in files], "done": h.name not in stale}
+    return names, todo, index
+
+
+def render(input_file, outdir, names, index, fmts=formats, jobs=4, chunk=8):
+    # the render queue: chunks of keys go to the pool, the cache is saved after every
+    # finished chunk so an interrupted run keeps what it already rendered
+    if not names:
+        return 0
+    chunks = [names[i:i+chunk] for i in range(0, len(names), chunk)]
+    n = 0
+    with concurrent.futures.ProcessPoolExecutor(min(jobs, len(chunks)), initializer=init_worker, initargs=(input_file,)) as pool:
+        futures = [pool.submit(render_chunk, (outdir, c, fmts)) for c in chunks]
+        for fut in concurrent.futures.as_completed(futures):
+            for name in fut.result():
+                index[name]["done"] = True
+                n += 1
+            save(outdir, index)
+    return n
+
+
+def save(outdir, index):
+    # only keys with their images on disk go into the cache
+    hcache.save_index(outdir, {k: {"hash": v["hash"], "files": v["files"]} for k, v in index.items() if v["done"]})
+
+
+def write_html(outdir, names, index, title="VBS histograms"):
+    # one static page: a section per region directory, for every key the linear and
+    # the log image inline (first image format) with links to all files
+    regions = {}
+    for name in names:
+        regions.setdefault(name.rpartition("/")[0], []).append(name)
+    lines = ["<!DOCTYPE html>", "<html><head><meta charset=\"utf-8\"><title>{}</title>".format(html.escape(title)),
+             "<style>body{font-family:sans-serif} .key{display:inline-block;margin:6px;vertical-align:top}"
+             " .key img{width:320px}</style></head><body>", "<h1>{}</h1>".format(html.escape(title))]
+    for region, keys in regions.items():
+        lines.append("<h2>{}</h2>".format(html.escape(region or "top level")))
+        for name in keys:
+            files = index[name]["files"]
+            show = [p for p in files if not p.endswith(".pdf")] or files
+            half = len(show)//2
+            lines.append("<div class=\"key\"><b>{}</b><br>".format(html.escape(name.rpartition("/")[2])))
+            for p in (show[0], show[half]):
+                if p.endswith(".pdf"):
+                    lines.append("<a href=\"{0}\">{0}</a>".format(html.escape(p)))
+                else:
+                    lines.append("<a href=\"{0}\"><img src=\"{0}\" loading=\"lazy\" alt=\"{0}\"></a>".format(html.escape(p)))
+            lines.append("<br>" + " ".join("<a href=\"{0}\">{1}</a>".format(html.escape(p), html.escape(os.path.basename(p))) for p in files))
+            lines.append("</div>")
+    lines.append("</body></html>")
+    path = os.path.join(outdir, "index.html")
+    with open(path, "w") as fout:
+        fout.write("\n".join(lines) + "\n")
+    return path
+
+
+if __name__=="__main__":
+    parser = argparse.ArgumentParser(description="render every histogram to image files in parallel, with an HTML index")
+    parser.add_argument("-i", "--input", default=uhist.input_file)
+    parser.add_argument("-o", "--outdir", default="plots")
+    parser.add_argument("-j", "--jobs", type=int, default=os.cpu_count() or 1, help="render worker processes")
+    parser.add_argument("-f", "--format", action="append", choices=formats, help="image formats (default all: {})".format(", ".join(formats)))
+    parser.add_argument("--include", action="append", default=[], help="only keys matching this glob (or re:regex), can be repeated")
+    parser.add_argument("--exclude", action="append", default=[], help="skip keys matching this glob (or re:regex), can be repeated")
+    parser.add_argument("--chunk", type=int, default=8, help="keys per queued render task")
+    parser.add_argument("--force", action="store_true", help="ignore the render cache")
+    args = parser.parse_args()
+
+    fmts = args.format or formats
+    filt = keyfilter.keyfilter(args.include, args.exclude) or None
+    os.makedirs(args.outdir, exist_ok=True)
+    names, todo, index = plan(args.input, args.outdir, filt, fmts, args.force)
+    print("{} of {} keys to render".format(len(todo), len(names)))
+    n = render(args.input, args.outdir, todo, index, fmts, args.jobs, args.chunk)
+    save(args.outdir, index)
+    print("Rendered {} keys, index in {}".format(n, write_html(args.outdir, names, index)))
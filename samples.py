@@ -0,0 +1,185 @@
+import argparse
+import concurrent.futures
+import csv
+import json
+import os
+import numpy as np
+import eventy
+import histio
+import normindex
+
+# multi-sample mode: signal + backgrounds from a manifest, processed concurrently,
+# normalised to cross section x luminosity and combined per key in one run
+#
+# manifest (JSON):
+# {"lumi": "L3",
+#  "samples": [
+#    {"name": "VBS_WpmWpmHjj", "path": "VBS.root", "type": "signal", "br": 1.0},
+#    {"name": "ttbar", "path": "ttbar/VBS.root", "type": "background", "xsec": 729800, "kfactor": 1.1}]}
+#
+# xsec in fb like eventy.xsec (ttbar: 729.8 pb = 729800 fb), lumi in fb^-1 or L2/L3/LHL, "path" can be a list of files
+# signal samples are normalised with eventy.yields (xsec*L*BR*brHWWbb, xsec defaults to
+# eventy.xsec), backgrounds with xsec*L*kfactor; both divided by the sum of weights from
+# the 1-bin mc_weight histogram (cached in normindex.py), unless the manifest gives "sumw"
+
+sumw_key = "mc_weight"
+
+
+def load_manifest(path):
+    with open(path) as fin:
+        man = json.load(fin)
+    for s in man["samples"]:
+        s.setdefault("type", "background")
+        if isinstance(s["path"], str):
+            s["path"] = [s["path"]]
+        base = os.path.dirname(os.path.abspath(path))
+        s["path"] = [p if os.path.isabs(p) else os.path.join(base, p) for p in s["path"]]
+    return man
+
+
+def expected(sample, lumi):
+    # expected weighted events for the whole sample before any selection
+    if sample["type"] == "signal":
+        return float(eventy.yields(sample.get("br", 1.0), lumi, sample.get("xsec", eventy.xsec))[0, 0, 0])
+    return sample["xsec"]*eventy.lumi_value(lumi)*sample.get("kfactor", 1.0)
+
+
+def load_sample(sample):
+    # every TH1 of every file of the sample, summed; runs in a worker process
+    hists = {}
+    for p in sample["path"]:
+        with histio.open_file(p) as f:
+            for h in histio.iter_hists(f):
+                if h.name in hists:
+                    t = hists[h.name]
+                    t.values = t.values + h.values
+                    t.sumw2 = t.sumw2 + h.sumw2
+                    t.entries = (t.entries or 0) + (h.entries or 0)
+                else:
+                    hists[h.name] = h
+    return sample["name"], hists
+
+
+def combine(man, jobs=None, lumi=None, index=normindex.index_file):
+    # returns (scaled, totals, table)
+    # scaled: sample -> key -> hdata normalised, totals: "signal"/"background" -> key -> hdata
+    # sums of weights come from the normindex cache (unless the manifest gives "sumw"),
+    # only new or rewritten files are scanned for them
+    lumi = lumi or man.get("lumi", "L3")
+    samples = man["samples"]
+    files = normindex.load_index(index)
+    normindex.update(files, [p for s in samples if "sumw" not in s for p in s["path"]], jobs)
+    loaded = {}
+    with concurrent.futures.ProcessPoolExecutor(jobs) as pool:
+        for name, hists in pool.map(load_sample, samples):
+            loaded[name] = hists
+    table = []
+    flat = []
+    factors = []
+    for s in samples:
+        if "sumw" in s:
+            sumw, events = float(s["sumw"]), None
+        else:
+            sumw, events = normindex.sample_sumw(files, s["path"])
+        exp = expected(s, lumi)
+        scale = exp/sumw if sumw else 0.
+        if "sumw" not in s:
+            normindex.set_norm(files, s["path"], scale, xsec=s.get("xsec", eventy.xsec), lumi=eventy.lumi_value(lumi))
+        hists = [h for key, h in loaded[s["name"]].items() if key != sumw_key]
+        flat += hists
+        factors += [scale]*len(hists)
+        table.append({"sample": s["name"], "type": s["type"], "sumw": sumw, "events": events, "expected": exp, "scale": scale, "nkeys": len(hists)})
+    normindex.save_index(files, index)
+    # every histogram of every sample scaled in one go
+    flat = normindex.normalise(flat, factors)
+    scaled = {}
+    totals = {"signal": {}, "background": {}}
+    i = 0
+    for s, row in zip(samples, table):
+        scaled[s["name"]] = {h.name: h for h in flat[i:i + row.pop("nkeys")]}
+        i += len(scaled[s["name"]])
+        for key, h in scaled[s["name"]].items():
+            tot = totals[s["type"]].get(key)
+            if tot is None:
+                totals[s["type"]][key] = histio.hdata(key, h.edges, h.values.copy(), h.sumw2.copy(), title=h.title,
+                                                      xtitle=h.xtitle, ytitle=h.ytitle)
+            else:
+                tot.values += h.values
+                tot.sumw2 += h.sumw2
+    return scaled, totals, table
+
+
+def yields(scaled, totals, table, key):
+    # weighted yield and error of one key (flow bins included) for every sample and the totals
+    rows = []
+    for row in table:
+        h = scaled[row["sample"]].get(key)
+        y, e = (h.values.sum(), np.sqrt(h.sumw2.sum())) if h is not None else (0., 0.)
+        rows.append(dict(row, key=key, entries=h.entries if h is not None else 0, yield_=y, error=e))
+    for kind in ("signal", "background"):
+        h = totals[kind].get(key)
+        if h is not None:
+            rows.append({"sample": "total_" + kind, "type": kind, "key": key, "yield_": h.values.sum(), "error": np.sqrt(h.sumw2.sum())})
+    sig = totals["signal"].get(key)
+    bkg = totals["background"].get(key)
+    if sig is not None and bkg is not None and bkg.values.sum() > 0:
+        rows.append({"sample": "s/sqrt(b)", "type": "", "key": key, "yield_": sig.values.sum()/np.sqrt(bkg.values.sum()), "error": 0.})
+    return rows
+
+
+def write_yields(rows, path):
+    cols = ["sample", "type", "key", "sumw", "events", "expected", "scale", "entries", "yield", "error"]
+    with open(path, "w", newline="") as fout:
+        w = csv.writer(fout)
+        w.writerow(cols)
+        for r in rows:
+            w.writerow([r.get("yield_" if c == "yield" else c, "") for c in cols])
+
+
+def write_output(path, man, scaled, totals):
+    # one directory per sample plus total_signal/ and total_background/, and stack_<key>
+    # cumulative histograms (backgrounds in manifest order, then signal on top)
+    hists = []
+    order = [s["name"] for s in man["samples"] if s["type"] == "background"] + [s["name"] for s in man["samples"] if s["type"] == "signal"]
+    for name in order:
+        for key, h in scaled[name].items():
+            hists.append(histio.hdata("{}/{}".format(name, key), h.edges, h.values, h.sumw2, title=name, xtitle=h.xtitle, ytitle=h.ytitle))
+    for kind, th in totals.items():
+        for key, h in th.items():
+            hists.append(histio.hdata("total_{}/{}".format(kind, key), h.edges, h.values, h.sumw2, title="total " + kind, xtitle=h.xtitle, ytitle=h.ytitle))
+    keys = {}
+    for name in order:
+        for key in scaled[name]:
+            keys.setdefault(key, None)
+    for key in keys:
+        run = None
+        for name in order:
+            h = scaled[name].get(key)
+            if h is None:
+                continue
+            run = h.values.copy() if run is None else run + h.values
+            hists.append(histio.hdata("stack_{}/{}".format(key, name), h.edges, run, title="stack up to " + name, xtitle=h.xtitle, ytitle=h.ytitle))
+    histio.write_hists(path, hists)
+
+
+if __name__=="__main__":
+    parser = argparse.ArgumentParser(description="normalise and combine signal and background samples")
+    parser.add_argument("manifest", help="sample manifest (JSON)")
+    parser.add_argument("-j", "--jobs", type=int, help="samples processed at the same time")
+    parser.add_argument("-l", "--lumi", help="L2, L3, LHL or fb^-1, overrides the manifest")
+    parser.add_argument("-k", "--yield-key", action="append", default=[], help="key(s) to build the yield table from (default jets_n, one fill per event)")
+    parser.add_argument("-o", "--output", default="VBS_stacked.root")
+    parser.add_argument("-y", "--yields", default="yields.csv")
+    parser.add_argument("--index", default=normindex.index_file, help="sum of weights cache")
+    args = parser.parse_args()
+
+    man = load_manifest(args.manifest)
+    scaled, totals, table = combine(man, args.jobs, args.lumi, args.index)
+    rows = []
+    for key in args.yield_key or ["jets_n"]:
+        rows += yields(scaled, totals, table, key)
+    write_yields(rows, args.yields)
+    write_output(args.output, man, scaled, totals)
+    for r in rows:
+        print("{:<24} {:<12} {:>14.4f} +- {:.4f}".format(r["sample"], r["key"], r["yield_"], r["error"]))
+    print("Wrote {} and {}".format(args.output, args.yields))
@@ -0,0 +1,143 @@
+import argparse
+import functools
+from statistics import NormalDist
+import numpy as np
+import eventy
+import histio
+
+# expected sensitivity over a BR x luminosity grid from one binned distribution
+# signal: shape of the key in the signal file, normalised to the eventy yield at each point
+# background: templates in events per fb^-1 (histogram * scale), times the luminosity
+# everything is one (nlumi, nbr, nbins) array, no python loop over grid points
+
+
+@functools.lru_cache(maxsize=None)
+def load_template(path, key):
+    # cached so repeated scans (other BR ranges, other keys of the same file) don't reread
+    with histio.open_file(path) as f:
+        h = histio.read_hist(f, key)
+    values = h.values[1:-1].copy()
+    values.setflags(write=False)
+    return values, h.edges
+
+
+def background(bkgs, key):
+    # bkgs: list of (path, scale), summed into one template per fb^-1
+    total = None
+    for path, scale in bkgs:
+        values, edges = load_template(path, key)
+        total = values*scale if total is None else total + values*scale
+    return total
+
+
+def signal_shape(path, key):
+    values, edges = load_template(path, key)
+    norm = values.sum()
+    if norm <= 0:
+        raise ValueError("signal histogram {} in {} is empty".format(key, path))
+    return values/norm
+
+
+def asimov_z(s, b):
+    # binned Asimov significance, bins without background are left out
+    ok = b > 0
+    bb = np.where(ok, b, 1)
+    z2 = 2*((s + bb)*np.log1p(s/bb) - s)
+    return np.sqrt(np.where(ok, np.clip(z2, 0, None), 0).sum(axis=-1))
+
+
+def q_mu(mu, s, b):
+    # q_mu on the background-only Asimov data set (n = b, muhat = 0)
+    ok = b > 0
+    bb = np.where(ok, b, 1)
+    t = mu[..., None]*s
+    return 2*np.where(ok, t - bb*np.log1p(t/bb), 0).sum(axis=-1)
+
+
+def cls_limit(s, b, cl=0.95, iterations=60):
+    # median expected CLs upper limit on the signal strength mu, asymptotic formulae:
+    # CLs = (1 - Phi(sqrt(q_mu,A))) / 0.5, solved for CLs = 1-cl by vectorized bisection
+    target = NormalDist().inv_cdf(1 - (1 - cl)/2)**2
+    lo = np.zeros(s.shape[:-1])
+    hi = np.ones(s.shape[:-1])
+    live = (s*(b > 0)).sum(axis=-1) > 0
+    while True:
+        low = live & (q_mu(hi, s, b) < target)
+        if not low.any():
+            break
+        hi = np.where(low, hi*2, hi)
+    for i in range(iterations):
+        mid = 0.5*(lo + hi)
+        above = q_mu(mid, s, b) >= target
+        hi = np.where(above, mid, hi)
+        lo = np.where(above, lo, mid)
+    return np.where(live, hi, np.inf), target
+
+
+def limit_bands(mu_up, target, cl=0.95, nsigma=(-2, -1, 1, 2)):
+    # +-N sigma expected bands from the Asimov sigma = mu_up / sqrt(q_mu,A)
+    sigma = mu_up/np.sqrt(target)
+    out = {}
+    for n in nsigma:
+        out[n] = sigma*(NormalDist().inv_cdf(1 - (1 - cl)*NormalDist().cdf(n)) + n)
+    return out
+
+
+def scan(signal, bkgs, key, br, lumi, xs=eventy.xsec, cl=0.95):
+    br = np.atleast_1d(np.asarray(br, dtype=np.float64))
+    lumi = np.atleast_1d(np.asarray([eventy.lumi_value(l) for l in np.atleast_1d(lumi)], dtype=np.float64))
+    shape = signal_shape(signal, key)
+    bt = background(bkgs, key)
+    ny = eventy.yields(br, lumi, xs)[0]             # (nlumi, nbr)
+    s = ny[:, :, None]*shape[None, None, :]          # (nlumi, nbr, nbins)
+    b = np.broadcast_to(lumi[:, None, None]*bt[None, None, :], s.shape)
+    z = asimov_z(s, b)
+    # q_mu only depends on mu*yield, so the limit is solved once per luminosity
+    # for the total signal count and then divided by the yield at every BR
+    nu_up, target = cls_limit(shape[None, :], lumi[:, None]*bt[None, :], cl)
+    with np.errstate(divide="ignore"):
+        mu_up = nu_up[:, None]/ny
+    out = {"br": br, "lumi": lumi, "yield": ny, "z": z, "mu_up": mu_up, "br_up": mu_up*br[None, :]}
+    for n, band in limit_bands(mu_up, target, cl).items():
+        out["br_up_{:+d}sigma".format(n)] = band*br[None, :]
+    return out
+
+
+def write_csv(res, path):
+    ll, bb = np.meshgrid(res["lumi"], res["br"], indexing="ij")
+    cols = ["lumi", "br", "yield", "z", "mu_up", "br_up"] + [k for k in res if k.startswith("br_up_")]
+    data = [ll.ravel(), bb.ravel()] + [res[c].ravel() for c in cols[2:]]
+    np.savetxt(path, np.column_stack(data), delimiter=",", header=",".join(cols), comments="", fmt="%.8g")
+
+
+def parse_bkg(arg):
+    # path.root or path.root:scale
+    path, sep, scale = arg.rpartition(":")
+    if not sep or "/" in scale:
+        return arg, 1.0
+    return path, float(scale)
+
+
+if __name__=="__main__":
+    parser = argparse.ArgumentParser(description="Asimov significance and expected CLs limits over a BR x luminosity grid")
+    parser.add_argument("--signal", required=True, help="signal analysis output (VBS.root)")
+    parser.add_argument("--bkg", action="append", required=True, help="background file[:scale to events per fb^-1], can be repeated")
+    parser.add_argument("--key", default="m_bb")
+    parser.add_argument("--br-range", nargs=3, type=float, default=(0.01, 1, 100), metavar=("START", "STOP", "N"))
+    parser.add_argument("--lumi", nargs="+", default=["L2", "L3", "LHL"])
+    parser.add_argument("--lumi-range", nargs=3, type=float, metavar=("START", "STOP", "N"))
+    parser.add_argument("--xsec", type=float, default=eventy.xsec)
+    parser.add_argument("--cl", type=float, default=0.95)
+    parser.add_argument("-o", "--output", default="scan.npz", help=".npz or .csv")
+    args = parser.parse_args()
+
+    br = np.linspace(args.br_range[0], args.br_range[1], int(args.br_range[2]))
+    lumi = args.lumi
+    if args.lumi_range:
+        lumi = np.linspace(args.lumi_range[0], args.lumi_range[1], int(args.lumi_range[2]))
+    res = scan(args.signal, [parse_bkg(b) for b in args.bkg], args.key, br, lumi, args.xsec, args.cl)
+    if args.output.endswith(".csv"):
+        write_csv(res, args.output)
+    else:
+        np.savez(args.output, **res)
+    print("Scanned {} x {} points of {}, wrote {}".format(len(res["lumi"]), len(res["br"]), args.key, args.output))
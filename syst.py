@@ -0,0 +1,86 @@
+import json
+import numpy as np
+import histio
+
+# weight-variation histograms: one contiguous (nbins+2, nvariations) array per variable,
+# column 0 the nominal generator weight (getMCWeights()[0]) when the variations come
+# from the mc_weights vector, filled for all variations in one pass by rehist.py
+# envelopes are the per-bin min/max over the variations
+
+
+class varhist:
+
+    def __init__(self, name, edges, values, sumw2, labels=None, xtitle="", ytitle=""):
+        self.name = name
+        self.edges = np.asarray(edges, dtype=np.float64)
+        self.values = np.asarray(values, dtype=np.float64)
+        self.sumw2 = np.asarray(sumw2, dtype=np.float64)
+        self.labels = list(labels) if labels is not None else ["w{}".format(i) for i in range(self.values.shape[1])]
+        self.xtitle = xtitle
+        self.ytitle = ytitle
+
+
+    def nvar(self):
+        return self.values.shape[1]
+
+
+    def envelope(self, nominal=0):
+        # per bin (nominal, low, high), flow bins included
+        return self.values[:, nominal], self.values.min(axis=1), self.values.max(axis=1)
+
+
+    def hist(self, i):
+        return histio.hdata("{}__{}".format(self.name, self.labels[i]), self.edges, self.values[:, i], self.sumw2[:, i],
+                            title=self.name, xtitle=self.xtitle, ytitle=self.ytitle)
+
+
+    def envelope_hists(self, nominal=0):
+        # nominal, envelope low and envelope high as histograms: name, name__env_down, name__env_up
+        nom, lo, hi = self.envelope(nominal)
+        out = []
+        for suffix, v in (("", nom), ("__env_down", lo), ("__env_up", hi)):
+            out.append(histio.hdata(self.name + suffix, self.edges, v, self.sumw2[:, nominal],
+                                    title=self.name + suffix, xtitle=self.xtitle, ytitle=self.ytitle))
+        return out
+
+
+def write_npz(vhists, path):
+    # one file for all variables: <name>/edges, <name>/values (nbins+2, nvar), <name>/sumw2,
+    # plus the labels and titles as JSON under "meta"
+    arrays = {}
+    meta = []
+    for vh in vhists:
+        arrays[vh.name + "/edges"] = vh.edges
+        arrays[vh.name + "/values"] = vh.values
+        arrays[vh.name + "/sumw2"] = vh.sumw2
+        meta.append({"name": vh.name, "labels": vh.labels, "xtitle": vh.xtitle, "ytitle": vh.ytitle})
+    arrays["meta"] = np.array(json.dumps(meta))
+    np.savez(path, **arrays)
+
+
+def read_npz(path):
+    out = []
+    with np.load(path) as f:
+        for m in json.loads(str(f["meta"])):
+            n = m["name"]
+            out.append(varhist(n, f[n + "/edges"], f[n + "/values"], f[n + "/sumw2"], m["labels"], m["xtitle"], m["ytitle"]))
+    return out
+
+
+def info(vh, nominal=0):
+    # systinfo.txt line: integrals of nominal and envelope, largest relative per-bin spread
+    nom, lo, hi = vh.envelope(nominal)
+    inner = slice(1, -1)
+    safe = np.where(nom[inner] != 0, np.abs(nom[inner]), np.inf)
+    spread = ((hi[inner] - lo[inner])/safe).max() if len(safe) else 0.
+    return "{}: Nominal: {}, Envelope: ({},{}), Max bin spread: {}, Variations: {}\n".format(
+        vh.name, nom[inner].sum(), lo[inner].sum(), hi[inner].sum(), float(spread), vh.nvar())
+
+
+def summary(path, out, nominal=0):
+    # the histoinfo.txt counterpart for a variations file
+    vhists = read_npz(path)
+    out.write('New contents\n')
+    for vh in vhists:
+        out.write(info(vh, nominal))
+    return len(vhists)
@@ -1,6 +1,24 @@
-import ROOT
-from ROOT import TCanvas, TFile, TH1D, TLegend
+import argparse
+import multiprocessing
 import os
+import features
+import hcache
+import json
+import keyfilter
+import pipeline
+import profiler
+
+# ROOT is only imported once canvases are actually drawn (load_root), the
+# --summary path never touches it
+ROOT = None
+
+
+def load_root():
+    global ROOT
+    if ROOT is None:
+        import ROOT as _ROOT
+        ROOT = _ROOT
+    return ROOT
 
 
 class hist:
@@ -12,8 +30,10 @@ class hist:
 
     def axistitles(self):
         self.h1.GetYaxis().SetTitle("Weighted Number of Entries")#not all of them are, waiting till thrusday lecture when the prof/jason go over them
-        if self.name in xname.keys():
-            self.h1.GetXaxis().SetTitle(xname[self.name])
+        # keys in region directories ("loose/m_bb") get the title of the variable
+        var = self.name.rpartition("/")[2]
+        if var in xname.keys():
+            self.h1.GetXaxis().SetTitle(xname[var])
         else:
             self.h1.GetXaxis().SetTitle("No X-axis title")
         #self.h1.SetOption("hist C"); # self.h1.SetOption("hist E"); 
@@ -25,7 +45,7 @@ class hist:
         binmax = self.h1.GetMaximumBin()
         x_max = self.h1.GetXaxis().GetBinCenter(binmax)
         y_max=self.h1.GetMaximum()
-        rv="{0}{1}{2},{3}{4}{5}{6}".format(str(name),": Max: (",str(x_max),str(y_max),"), Mean: ",str(h1.GetMean(1)),"\n")
+        rv="{}: Max: ({},{}), Mean: {}\n".format(self.name, x_max, y_max, self.h1.GetMean(1))
         return rv
 
 #    def logit(self,clist,c):
@@ -91,48 +111,378 @@ xname = {
     'gen_filt_met' : "NA",
     'gen_filt_ht' : "NA",
     'mc_weight' : "NA",
-    'dR_j1_j2' : "dR of jets 1 and 2",
-    'dR_j1_j3' : "dR of jets 1 and 3",
-    'dR_j1_j4' : "dR of jets 1 and 4",
-    'dR_j1_j5' : "dR of jets 1 and 5",
-    'dR_j1_j6' : "dR of jets 1 and 6",
-    'dR_j2_j3' : "dR of jets 2 and 3",
-    'dR_j2_j4' : "dR of jets 2 and 4",
-    'dR_j2_j5' : "dR of jets 2 and 5",
-    'dR_j2_j6' : "dR of jets 2 and 6",
-    'dR_j3_j4' : "dR of jets 3 and 4",
-    'dR_j3_j5' : "dR of jets 3 and 5",
-    'dR_j3_j6' : "dR of jets 3 and 6",
-    'dR_j4_j5' : "dR of jets 4 and 5",
-    'dR_j4_j6' : "dR of jets 4 and 6",
-    'dR_j5_j6' : "dR of jets 5 and 6",
-    'dR_bj1_bj2' : "dR of bjets 1 and 2",
-    'dR_bj1_bj3' : "dR of bjets 1 and 3",
-    'dR_bj1_bj4' : "dR of bjets 1 and 4",
-    'dR_bj2_bj3' : "dR of bjets 2 and 3",
-    'dR_bj2_bj4' : "dR of bjets 2 and 4",
-    'dR_bj3_bj4' : "dR of bjets 3 and 4",
-    'dR_l1_l2' : "dR of lep 1 and 2",
 
 }
+# the dR_j1_j2 ... dR_l1_l2 titles come from the pairwise feature registry
+xname.update(features.xnames())
 # x=[]
 # y=[]
 
+input_file= "/export/nfs0home/rmgleaso/data/uclhc/uci/rmgleaso/atlas/VBS_MCTruth/run/VBS.root"
+output = "/export/nfs0home/rmgleaso/data/uclhc/uci/rmgleaso/atlas/VBS_MCTruth/run/VBSnew.root"
+
+
+# how every histogram is drawn, the same for the canvases and for --compact files
+# (where it is stored once as the uhist_meta TNamed instead of in two canvases per key)
+draw_meta = {"option": "hist C", "log": {"prefix": "log_", "logx": True, "title": "Log"}}
+
+# ROOT compression algorithms, setting = 100*algorithm + level
+compression_algorithms = {"zlib": 1, "lzma": 2, "lz4": 4, "zstd": 5}
+
+
+def compression_setting(arg):
+    # "lz4", "zstd:7", "none" ...
+    alg, sep, level = arg.partition(":")
+    if alg == "none":
+        return 0
+    if alg not in compression_algorithms:
+        raise ValueError("unknown compression {}, use one of {} or none".format(alg, ", ".join(compression_algorithms)))
+    return 100*compression_algorithms[alg] + (int(level) if sep else 4)
+
+
+def canvas_name(name, log=False, meta=draw_meta):
+    # TCanvas names are global and a new canvas deletes any canvas of the same name,
+    # which may still be queued in the --write-batch writer: the name comes from the
+    # whole key ("loose/m_bb" -> "loose__m_bb"), so region keys never share one
+    name = name.replace("/", "__")
+    return meta["log"]["prefix"] + name if log else name
+
+
+def canvas(h1, name, log=False, meta=draw_meta):
+    # name: the key; the canvas is written under the key's own name by the caller
+    c = ROOT.TCanvas(canvas_name(name, log, meta))
+    c.cd()
+    h1.Draw(meta["option"])
+    if log:
+        c.SetLogx(meta["log"]["logx"])
+        c.SetTitle(meta["log"]["title"])
+    #c.Update()
+    return c
+
+
+def render(path, name, log=False):
+    # canvas for one key of a --compact output, drawn only when asked for
+    load_root()
+    fin = ROOT.TFile(path)
+    meta = draw_meta
+    m = fin.Get("uhist_meta")
+    if m:
+        meta = json.loads(m.GetTitle())
+    h1 = fin.Get(name)
+    h1.SetDirectory(0)
+    fin.Close()
+    return canvas(h1, name, log, meta)
+
+
+def out_dir(outp, name):
+    # "loose/m_bb" -> (the loose directory in outp, made if it isn't there yet, "m_bb")
+    path, _, base = name.rpartition("/")
+    d = outp
+    for part in path.split("/") if path else []:
+        sub = d.GetDirectory(part)
+        d = sub if sub else d.mkdir(part)
+    return d, base
+
+
+def release(*objs):
+    # --stream: hand the objects back as soon as they are written instead of leaving
+    # canvases in gROOT's list of canvases and histograms in the input directory;
+    # python owns them afterwards, so they are deleted with the last reference
+    for obj in objs:
+        if obj.InheritsFrom("TCanvas"):
+            obj.Close()
+        else:
+            obj.SetDirectory(0)
+        ROOT.SetOwnership(obj, True)
+
+
+def process_keys(f, outp, names, file1, prof=None, compact=False, pre=None, out=None, stream=False):
+    # draws and writes the linear and log canvas for every key in names, in order
+    # prof: profiler.profiler to time every stage of every key (--profile)
+    # compact: write the titled histogram once instead of the two canvases
+    # pre/out: pipeline.prefetcher and pipeline.writer (--prefetch, --write-batch),
+    # with a writer the objects are only queued and outp isn't touched from here
+    # stream: release every canvas and histogram right after it is written, memory
+    # stays flat however many keys there are
+    # names in subdirectories are written into the same directories of the output
+    if prof is None:
+        prof = profiler.null()
+    # with a writer the loop only queues the objects ("enqueue"), the writes themselves
+    # are timed in the writer thread and added as "write" when it is closed
+    wstage = "write" if out is None else "enqueue"
+    for name in names:
+        print(name)
+        path, _, base = name.rpartition("/")
+        log_name = (path + "/" if path else "") + draw_meta["log"]["prefix"] + base
+        if out is None:
+            d, base = out_dir(outp, name)
+            d.cd()
+        with prof.stage("get", name):
+            if pre is not None:
+                pre.wait(name)
+            h1=f.Get(name)
+        with prof.stage("axistitles", name):
+            histo=hist(h1,name)
+            h1=histo.axistitles()
+
+        if file1 is not None:
+            with prof.stage("pdata", name):
+                file1.write(histo.pdata())
+
+        if compact:
+            with prof.stage(wstage, name):
+                h1.SetOption(draw_meta["option"])
+                if out is not None:
+                    out.put(name, h1, ("write", name))
+                else:
+                    d.WriteTObject(h1, base)
+            if stream:
+                if out is not None:
+                    out.drop(h1)
+                else:
+                    release(h1)
+                del h1, histo
+            continue
+
+        with prof.stage("draw", name):
+            c = canvas(h1, name)
+        with prof.stage(wstage, name):
+            if out is not None:
+                out.put(name, c, ("write", name))
+            else:
+                d.WriteTObject(c, base)
+
+        with prof.stage("draw_log", name):
+            c_log = canvas(h1, name, log=True)
+        with prof.stage(wstage + "_log", name):
+            if out is not None:
+                out.put(log_name, c_log, ("write_log", name))
+            else:
+                d.WriteTObject(c_log, draw_meta["log"]["prefix"] + base)
+
+        if stream:
+            # canvases first, they still point at h1
+            if out is not None:
+                out.drop(c, c_log, h1)
+            else:
+                release(c, c_log, h1)
+            del c, c_log, h1, histo
+
+
+def threaded_io():
+    # the writer thread writes while the loop draws: ROOT has to know about the
+    # threads, and the writes have to let go of the GIL to overlap with anything
+    ROOT.EnableThreadSafety()
+    for cls in (ROOT.TDirectory, ROOT.TDirectoryFile, ROOT.TFile):
+        cls.WriteTObject.__release_gil__ = True
+
+
+def keyloop(f, outp, names, file1, prof=None, compact=False, prefetch=0, batch=0, stream=False):
+    # process_keys with the optional read-ahead and write-behind around it
+    pre = out = None
+    if prefetch > 0:
+        pre = pipeline.prefetcher(f.GetName(), pipeline.root_ranges(f, names), depth=prefetch)
+    if batch > 0:
+        out = pipeline.writer(outp, out_dir, batch=batch, release=release, timed=prof is not None)
+    try:
+        process_keys(f, outp, names, file1, prof, compact, pre, out, stream)
+    finally:
+        if out is not None:
+            out.close()
+            if prof is not None:
+                for (stage, name), wall in out.timings:
+                    prof.add(stage, name, wall)
+        if pre is not None:
+            pre.close()
+            print("Prefetched {:.1f} MB".format(pre.bytes/1e6))
+
+
+def write_meta(outp):
+    meta = ROOT.TNamed("uhist_meta", json.dumps(draw_meta))
+    outp.WriteTObject(meta, "uhist_meta", "Overwrite")
+
+
+def drop(outp, name):
+    d, base = out_dir(outp, name)
+    d.Delete(base + ";*")
+    d.Delete(draw_meta["log"]["prefix"] + base + ";*")
+
+
+def check_keys(f, outp, lnames, index, compact=False, stream=False, filt=None):
+    # --incremental: fingerprint every input histogram against the sidecar index,
+    # drop the canvases of stale and changed keys and return the keys to redraw
+    # filt: the keyfilter lnames was selected with; indexed keys outside it are not
+    # looked at in this run, so they are kept rather than dropped as stale
+    todo = []
+    for name in lnames:
+        h1=f.Get(name)
+        histo=hist(h1,name)
+        h1=histo.axistitles()
+        # the output layout is part of the fingerprint, switching --compact redraws everything
+        fp = hcache.fingerprint(h1, name, "compact" if compact else "canvas")
+        changed = name not in index or index[name]["hash"] != fp
+        if changed:
+            if name in index:
+                drop(outp, name)
+            index[name] = {"hash": fp, "info": histo.pdata()}
+            todo.append(name)
+        if stream:
+            release(h1)
+            del h1, histo
+    keep = set(lnames)
+    for name in list(index):
+        if name not in keep and (filt is None or filt.match(name)):
+            print("Dropping stale {}".format(name))
+            drop(outp, name)
+            del index[name]
+    return todo
+
+
+def run_chunk(task):
+    # worker side of --jobs: own input TFile, own partial output + partial histoinfo
+    input_file, part, names, profile, compact, prefetch, batch, stream = task
+    load_root()
+    ROOT.gROOT.SetBatch(True)
+    if batch > 0:
+        threaded_io()
+    prof = profiler.profiler() if profile else None
+    f = ROOT.TFile(input_file)
+    outp = ROOT.TFile(part, "RECREATE")
+    with open(part + ".txt", "w") as file1:
+        keyloop(f, outp, names, file1, prof, compact, prefetch, batch, stream)
+    outp.Close()
+    f.Close()
+    if prof is not None:
+        prof.write(part + ".prof.json")
+    return part
+
+
+def copy_keys(src, dst):
+    # every object of src into dst, subdirectories included
+    for key in src.GetListOfKeys():
+        obj = key.ReadObj()
+        if obj.InheritsFrom("TDirectory"):
+            sub = dst.GetDirectory(key.GetName())
+            copy_keys(obj, sub if sub else dst.mkdir(key.GetName()))
+            continue
+        dst.cd()
+        obj.Write(key.GetName())
+
+
+def merge_parts(parts, outp, file1, prof=None):
+    # parts come back in the same order as the key chunks, so copying them
+    # one after the other keeps the original key order
+    for part in parts:
+        pf = ROOT.TFile(part)
+        copy_keys(pf, outp)
+        pf.Close()
+        if file1 is not None:
+            with open(part + ".txt") as ptxt:
+                file1.write(ptxt.read())
+        os.remove(part)
+        os.remove(part + ".txt")
+        if prof is not None:
+            with open(part + ".prof.json") as pjson:
+                prof.merge(json.load(pjson))
+            os.remove(part + ".prof.json")
+
+
+def run_parallel(input_file, output, lnames, jobs, outp, file1, prof=None, compact=False, prefetch=0, batch=0, stream=False):
+    jobs = min(jobs, len(lnames))
+    size = -(-len(lnames) // jobs)
+    tasks = []
+    for i in range(jobs):
+        names = lnames[i*size:(i+1)*size]
+        if names:
+            tasks.append((input_file, "{}.part{}".format(output, i), names, prof is not None, compact, prefetch, batch, stream))
+    print("Splitting {} keys over {} workers".format(len(lnames), len(tasks)))
+    with multiprocessing.Pool(len(tasks)) as pool:
+        parts = pool.map(run_chunk, tasks)
+    print("Merging partial outputs")
+    merge_parts(parts, outp, file1, prof)
+
+
 if __name__=="__main__":
-    
-    input_file= "/export/nfs0home/rmgleaso/data/uclhc/uci/rmgleaso/atlas/VBS_MCTruth/run/VBS.root"
+
+    parser = argparse.ArgumentParser()
+    parser.add_argument("-i", "--input", default=input_file)
+    parser.add_argument("-o", "--output", default=output)
+    parser.add_argument("-j", "--jobs", type=int, default=1, help="number of worker processes")
+    parser.add_argument("--incremental", action="store_true", help="only redraw keys whose input histogram changed")
+    parser.add_argument("--summary", action="store_true", help="only write histoinfo.txt, without ROOT or canvases")
+    parser.add_argument("--stats", action="append", default=[], help="write the batch statistics table (.csv, .json or .npz), can be repeated")
+    parser.add_argument("--store", help="also export every histogram into a memory mapped store directory (see hstore.py)")
+    parser.add_argument("--syst", help="weight variation arrays from rehist.py --variations (.npz), per-key envelopes into systinfo.txt")
+    parser.add_argument("--profile", nargs="?", const="uhist_profile.json", help="time every stage of every key, JSON report (default uhist_profile.json)")
+    parser.add_argument("--top", type=int, default=10, help="slowest keys to list with --profile")
+    parser.add_argument("--compact", action="store_true", help="store each histogram once with draw metadata instead of two canvases")
+    parser.add_argument("--include", action="append", default=[], help="only keys matching this glob (or re:regex), e.g. 'dR_*' or 'loose/*', can be repeated")
+    parser.add_argument("--exclude", action="append", default=[], help="skip keys matching this glob (or re:regex), can be repeated")
+    parser.add_argument("--prefetch", type=int, default=0, help="read this many keys ahead of the loop in background threads (for NFS inputs), 0 = off")
+    parser.add_argument("--write-batch", type=int, default=0, help="write the output from a separate thread in batches of this many objects, 0 = inline")
+    parser.add_argument("--stream", action="store_true", help="free every canvas and histogram once written, flat memory for any number of keys")
+    parser.add_argument("--compression", type=compression_setting, help="output compression: lz4 (fast), zstd (small), zlib, lzma or none, optional :level")
+    args = parser.parse_args()
+    input_file = args.input
+    output = args.output
+    # subdirectories are always walked, the filter only selects among the keys
+    filt = keyfilter.keyfilter(args.include, args.exclude) or None
+
+    if args.stats:
+        import histio
+        import hstats
+        with histio.open_file(input_file) as fin:
+            tab = hstats.table(histio.iter_hists(fin, histio.keys(fin, filt)))
+        for path in args.stats:
+            hstats.write_table(tab, path)
+            print("Wrote stats for {} histograms to {}".format(len(tab["name"]), path))
+
+    if args.store:
+        import hstore
+        n = hstore.export(input_file, args.store, filt, xname)
+        print("Exported {} histograms to {}".format(n, args.store))
+
+    if args.syst:
+        import syst
+        with open("systinfo.txt", "w") as file1:
+            n = syst.summary(args.syst, file1)
+        print("Wrote envelopes of {} histograms to systinfo.txt".format(n))
+
+    if args.summary:
+        import histio
+        with open("histoinfo.txt", "w") as file1:
+            n = histio.summary(input_file, file1, filt, args.stream)
+        print("Wrote {} histograms to histoinfo.txt".format(n))
+        raise SystemExit(0)
+
+    load_root()
+    if args.write_batch > 0:
+        threaded_io()
+    prof = profiler.profiler() if args.profile else None
+
     f = ROOT.TFile(input_file)
     print("Open VBS.root")
-    
-    reset = True
-    output = "/export/nfs0home/rmgleaso/data/uclhc/uci/rmgleaso/atlas/VBS_MCTruth/run/VBSnew.root"
-    routput = output.split("/")[-1] 
+
+    reset = not args.incremental
+    index = {}
+    routput = output.split("/")[-1]
     print("Open output {}".format(routput))
-    if(os.path.exists(output) and reset): 
-        os.remove(output)
-        outp = ROOT.TFile(output, "RECREATE")
+    if os.path.exists(output) and not reset:
+        index = hcache.load_index(output)
+    if index:
+        outp = ROOT.TFile(output, "UPDATE")
     else:
+        # no usable index (plain run before, or a lost index): nothing in the old output
+        # is known to be current, and UPDATE would add every canvas again as a new cycle;
+        # the old sidecar index goes too, it describes the output being replaced (other
+        # keys, filter or layout) and a later --incremental run must not trust it
+        if os.path.exists(output):
+            os.remove(output)
+        if os.path.exists(hcache.index_path(output)):
+            os.remove(hcache.index_path(output))
         outp = ROOT.TFile(output, "RECREATE")
+    if args.compression is not None:
+        outp.SetCompressionSettings(args.compression)
 
 
     file1 = open("histoinfo.txt", "w")
@@ -141,52 +491,41 @@ if __name__=="__main__":
     # file1.seek(0)                        # <- This is the missing piece
     # file1.truncate()
     file1.write('New contents\n')
-    
+
     print("Grabbing Keys")
-    lnames = [] 
-    for i in f.GetListOfKeys() :
-        lnames.append(i.GetName())
+    # region directories are walked too ("loose/m_bb"); only key metadata is read here,
+    # f.Get later happens for the (matching) histograms alone
+    lnames = list(keyfilter.walk_root(f, filt))
 
     print(lnames)
 
+    todo = lnames
+    info = file1
+    if args.incremental:
+        todo = check_keys(f, outp, lnames, index, args.compact, args.stream, filt)
+        print("{} of {} keys changed".format(len(todo), len(lnames)))
+        # histoinfo.txt comes from the index so unchanged keys keep their line
+        for name in lnames:
+            file1.write(index[name]["info"])
+        info = None
+
     print("Loop")
-    clist = ROOT.TList()
-    for i in range(len(lnames)):
-       
-        name = lnames[i]
-        print(name)
-        h1=f.Get(name)
-        histo=hist(h1,name)
-        h1=histo.axistitles()
+    if args.jobs > 1 and len(todo) > 1:
+        f.Close()
+        run_parallel(input_file, output, todo, args.jobs, outp, info, prof, args.compact, args.prefetch, args.write_batch, args.stream)
+    else:
+        keyloop(f, outp, todo, info, prof, args.compact, args.prefetch, args.write_batch, args.stream)
+    if args.compact:
+        write_meta(outp)
 
-        file1.write(histo.pdata())
-
-        c = ROOT.TCanvas(name)
-        c.cd()
-        h1.Draw("hist C")
-        #c.Update()
-        #clist.Add(c)
-        c.Write()
-       
-        #clist=histo.logit(clist,c)
-        c_name = "log_" + name 
-        c_log = ROOT.TCanvas(c_name)
-        c_log.cd()
-        #print(name)
-        h1.Draw("hist C")
-        c_log.SetLogx()
-        c_log.SetTitle("Log")
-        #c_log.Update()
-        c_log.Write()
-        #clist.Add(c_log)
-        
-        #break
-        #c2_log = ROOT.TCanvas(f"dumb_{name}")
-        #h1.Draw()
-
-
-
-    #clist.Write()
-    #clist.Delete()
+    if args.incremental:
+        hcache.save_index(output, index)
+
+    file1.close()
     print("Done, now go to X2Go and check the graphs")
     outp.Close()
+
+    if prof is not None:
+        prof.write(args.profile, args.top)
+        print(prof.summary(args.top))
+        print("Profile written to {}".format(args.profile))